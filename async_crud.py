@@ -0,0 +1,99 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import delete as sql_delete, insert, select, update as sql_update
+from cache import CACHED_NAMESPACES, cache, cached_json_async, off_loop
+from events import broker
+from filters import ListQuery, list_query
+from bulk import ID_BOUNDS, by_id, delete_linked_rows
+from crud import check_patch, check_write, delete_response
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, json_response, paginate_async, stream_ndjson_async
+from replicas import use_primary
+from schemas import Page, partial
+
+
+def async_crud_router(prefix, model, schema, create_schema, label, get_db):
+    # Async counterparts of crud_router's handlers, used when DB_ASYNC is set;
+    # they run on the event loop, so no threadpool slot is held while waiting on Postgres
+    router = APIRouter()
+    namespace = prefix.strip("/")
+    cached = namespace in CACHED_NAMESPACES
+    patch_schema = partial(create_schema)
+
+    async def get_or_404(db, item_id):
+        if model in ID_BOUNDS:
+            item = (await db.scalars(select(model).where(*by_id(model, item_id)))).one_or_none()
+        else:
+            item = await db.get(model, item_id)
+        if item is None:
+            raise HTTPException(status_code=404, detail=f"{label} not found")
+        return item
+
+    async def write(db, stmt, action):
+        item = (await db.scalars(stmt.returning(model))).one_or_none()
+        if item is None:
+            raise HTTPException(status_code=404, detail=f"{label} not found")
+        await db.commit()
+        await off_loop(cache.backend, cache.invalidate, namespace)
+        broker.publish(namespace, action, [item.id], schema.model_validate(item).model_dump(mode="json"))
+        return item
+
+    @router.get(prefix, response_model=Page[schema])
+    async def get_all(
+        after_id: Optional[int] = None,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        stream: bool = False,
+        query: ListQuery = Depends(list_query(model)),
+        db=Depends(get_db),
+    ):
+        if stream:
+            return stream_ndjson_async(model, schema, after_id, query)
+        if cached:
+            use_primary(db)
+            async def load():
+                return await paginate_async(db, model, schema, after_id, limit, query)
+            return await cached_json_async(namespace, f"list:{query.cache_key}", load)
+        return json_response(await paginate_async(db, model, schema, after_id, limit, query))
+
+    @router.get(prefix + "{id}", response_model=schema)
+    async def get_one(id: int, db=Depends(get_db)):
+        if cached:
+            use_primary(db)
+            async def load():
+                return schema.model_validate(await get_or_404(db, id)).model_dump_json()
+            return await cached_json_async(namespace, f"item:{id}", load)
+        return await get_or_404(db, id)
+
+    @router.post(prefix, response_model=schema)
+    async def create(item: create_schema, db=Depends(get_db)):
+        data = item.model_dump()
+        await db.run_sync(check_write, model, None, data)
+        return await write(db, insert(model).values(**data), "created")
+
+    @router.put(prefix + "{id}", response_model=schema)
+    async def replace(id: int, item: create_schema, db=Depends(get_db)):
+        data = item.model_dump()
+        await db.run_sync(check_write, model, id, data)
+        return await write(db, sql_update(model).where(*by_id(model, id)).values(**data), "updated")
+
+    @router.patch(prefix + "{id}", response_model=schema)
+    async def patch(id: int, item: patch_schema, db=Depends(get_db)):
+        data = item.model_dump(exclude_unset=True)
+        if not data:
+            return await get_or_404(db, id)
+        check_patch(model, data)
+        await db.run_sync(check_write, model, id, data)
+        return await write(db, sql_update(model).where(*by_id(model, id)).values(**data), "updated")
+
+    @router.delete(prefix + "{id}", response_model=dict)
+    async def remove(id: int, db=Depends(get_db)):
+        for linked in delete_linked_rows(model, [id]):
+            await db.execute(linked)
+        deleted = (await db.scalars(sql_delete(model).where(*by_id(model, id)).returning(model.id))).one_or_none()
+        if deleted is None:
+            raise HTTPException(status_code=404, detail=f"{label} not found")
+        await db.commit()
+        await off_loop(cache.backend, cache.invalidate, namespace)
+        broker.publish(namespace, "deleted", [id])
+        return delete_response(namespace, label)
+
+    return router
@@ -0,0 +1,283 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Reproducible latency / throughput benchmark of the API, run in-process
+# through httpx's ASGI transport (no server, no network):
+#
+#   python benchmark.py --save-baseline      # record benchmark_baseline.json
+#   python benchmark.py --compare            # exit 1 on a regression
+#
+# --database-url must point at a scratch database (default: a local SQLite
+# file). Tables are created and, when empty, seeded with --scale x VOLUMES rows.
+#
+# The committed benchmark_baseline.json was recorded with the defaults on
+# SQLite. Its queries per request and errors hold anywhere; latency and
+# throughput depend on the machine, so re-record it (--save-baseline) on the
+# machine that runs --compare before trusting the p95 / rps flags.
+
+DEFAULT_DATABASE_URL = "sqlite:///benchmark.db?check_same_thread=false"
+DEFAULT_BASELINE = "benchmark_baseline.json"
+
+# Rows per table at --scale 1
+VOLUMES = {
+    "clients": 2000,
+    "vehicles": 3000,
+    "masters": 40,
+    "responsibles": 10,
+    "providedservices": 60,
+    "repairparts": 400,
+    "repairsessions": 10000,
+    "warrantiescards": 4000,
+}
+
+SEED_CHUNK_SIZE = 5000
+
+
+# --- Seeding ---
+def _rows(n, rng):
+    # Row dicts per model name, with explicit ids 1..n so scenarios can pick valid ones
+    start = datetime(2023, 1, 1, 8)
+    yield "Clients", ({"id": i, "name": f"Client {i}", "telephone": f"+38050{i:07d}"} for i in range(1, n["clients"] + 1))
+    yield "Masters", ({"id": i, "name": f"Master {i}", "telephone": f"+38067{i:07d}"} for i in range(1, n["masters"] + 1))
+    yield "Responsibles", ({"id": i, "name": f"Responsible {i}", "telephone": f"+38063{i:07d}"} for i in range(1, n["responsibles"] + 1))
+    yield "Providedservices", (
+        {"id": i, "name": f"Service {i}", "category": rng.choice(["engine", "body", "electrics", "chassis"]),
+         "difficulty": rng.choice(["легко", "середнє", "складно"])}
+        for i in range(1, n["providedservices"] + 1)
+    )
+    yield "Repairparts", (
+        {"id": i, "name": f"Part {i}", "amount_on_station": rng.randint(0, 200), "amount_on_storage": rng.randint(0, 500)}
+        for i in range(1, n["repairparts"] + 1)
+    )
+    yield "Vehicles", (
+        {"id": i, "brand": rng.choice(["Toyota", "Skoda", "Renault", "VW", "Ford"]), "model": f"Model {i % 50}",
+         "manufacture_year": rng.randint(1995, 2024), "client_id": rng.randint(1, n["clients"])}
+        for i in range(1, n["vehicles"] + 1)
+    )
+    sessions = []
+    for i in range(1, n["repairsessions"] + 1):
+        date_start = start + timedelta(hours=rng.randint(0, 3 * 365 * 24))
+        total = rng.randint(500, 20000)
+        sessions.append({
+            "id": i, "order_number": f"A-{i:07d}", "date_start": date_start,
+            "date_end": date_start + timedelta(hours=rng.randint(1, 8)),
+            "malfunctions": "noise", "order_comment": None, "total_sum": total, "paid_sum": rng.choice([0, total // 2, total]),
+            "if_finished": rng.random() < 0.8, "vehicle_id": rng.randint(1, n["vehicles"]),
+            "responsible_id": rng.randint(1, n["responsibles"]), "master_id": rng.randint(1, n["masters"]),
+        })
+    yield "Repairsessions", sessions
+    yield "RepairsessionsRepairparts", (
+        {"repair_session_id": i, "repair_part_id": part_id, "amount": rng.randint(1, 4)}
+        for i in range(1, n["repairsessions"] + 1)
+        for part_id in rng.sample(range(1, n["repairparts"] + 1), min(2, n["repairparts"]))
+    )
+    yield "RepairsessionsProvidedservices", (
+        {"repair_session_id": i, "provided_service_id": rng.randint(1, n["providedservices"])}
+        for i in range(1, n["repairsessions"] + 1)
+    )
+    yield "Warrantiescards", (
+        {"id": i, "start_date": start + timedelta(days=i % 1000), "end_date": start + timedelta(days=i % 1000 + 365),
+         "vehicle_id": rng.randint(1, n["vehicles"]), "provided_service_id": rng.randint(1, n["providedservices"])}
+        for i in range(1, n["warrantiescards"] + 1)
+    )
+
+
+def seed(scale, rng):
+    # Returns the highest id per table, reusing the existing rows when already seeded
+    import models
+    from sqlalchemy import func, insert, select
+
+    if models.engine.dialect.name == "postgresql":
+        models.difficulty_enum.create(models.engine, checkfirst=True)
+    models.Base.metadata.create_all(models.engine)
+    tables = {name: getattr(models, name.capitalize()) for name in VOLUMES}
+    with models.SessionLocal() as db:
+        if db.scalar(select(func.count()).select_from(models.Clients)) == 0:
+            n = {name: max(1, int(volume * scale)) for name, volume in VOLUMES.items()}
+            started = time.perf_counter()
+            for model_name, rows in _rows(n, rng):
+                rows = list(rows)
+                for i in range(0, len(rows), SEED_CHUNK_SIZE):
+                    db.execute(insert(getattr(models, model_name)), rows[i:i + SEED_CHUNK_SIZE])
+            db.commit()
+            print(f"Seeded {sum(n.values())} rows in {time.perf_counter() - started:.1f}s")
+        else:
+            print("Database already seeded, reusing its rows")
+        max_ids = {name: db.scalar(select(func.max(model.id))) or 1 for name, model in tables.items()}
+    models.sync_id_sequences(models.engine)
+    return max_ids
+
+
+# --- Scenarios ---
+def scenarios(n):
+    # name -> function(rng) returning (method, url, json body)
+    some = lambda rng, table: rng.randint(1, n[table])
+    return {
+        "list clients": lambda rng: ("GET", "/clients/?limit=100", None),
+        "get client": lambda rng: ("GET", f"/clients/{some(rng, 'clients')}", None),
+        "filter vehicles by client": lambda rng: ("GET", f"/vehicles/?client_id={some(rng, 'clients')}", None),
+        "list masters (cached)": lambda rng: ("GET", "/masters/", None),
+        "list sessions by date": lambda rng: ("GET", "/repairsessions/?sort=-date_start&limit=50", None),
+        "open sessions of master": lambda rng: ("GET", f"/repairsessions/?master_id={some(rng, 'masters')}&if_finished=false", None),
+        "expanded session": lambda rng: (
+            "GET", f"/repairsessions/{some(rng, 'repairsessions')}/expanded?expand=vehicle,master,repair_parts,provided_services", None
+        ),
+        "revenue by month": lambda rng: ("GET", "/reports/revenue?granularity=month", None),
+        "top parts": lambda rng: ("GET", "/reports/parts/top", None),
+        "create client": lambda rng: ("POST", "/clients/", {"name": "Benchmark", "telephone": "+380000000000"}),
+        "patch session": lambda rng: ("PATCH", f"/repairsessions/{some(rng, 'repairsessions')}", {"paid_sum": rng.randint(0, 1000)}),
+    }
+
+
+# --- Load generation ---
+def _percentile(quantiles, p):
+    return round(quantiles[p - 1] * 1000, 2)
+
+
+async def run_scenario(client, make_request, requests, concurrency, warmup, rng):
+    from metrics import request_queries
+
+    for _ in range(warmup):
+        method, url, body = make_request(rng)
+        await client.request(method, url, json=body)
+
+    latencies, errors = [], 0
+    pending = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in pending:
+            method, url, body = make_request(rng)
+            started = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    queries_before, count_before = request_queries.totals()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    queries_after, count_after = request_queries.totals()
+
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "p50_ms": _percentile(quantiles, 50),
+        "p95_ms": _percentile(quantiles, 95),
+        "p99_ms": _percentile(quantiles, 99),
+        "rps": round(requests / elapsed, 1),
+        "queries_per_request": round((queries_after - queries_before) / max(count_after - count_before, 1), 2),
+        "errors": errors,
+    }
+
+
+async def run(names, n, args):
+    import httpx
+    from main import app
+
+    rng = random.Random(args.seed)
+    available = scenarios(n)
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        for name in names:
+            results[name] = await run_scenario(client, available[name], args.requests, args.concurrency, args.warmup, rng)
+            print(_format_row(name, results[name]), flush=True)
+    return results
+
+
+# --- Reporting ---
+COLUMNS = ("p50_ms", "p95_ms", "p99_ms", "rps", "queries_per_request", "errors")
+HEADERS = ("p50 ms", "p95 ms", "p99 ms", "req/s", "queries/req", "errors")
+
+
+def _format_row(name, result):
+    return f"{name:<28}" + "".join(f"{result[column]:>12}" for column in COLUMNS)
+
+
+def compare(results, baseline, tolerance):
+    # Slower p95, lower throughput, more queries per request or more failed
+    # requests than the baseline
+    regressions = []
+    print("\nAgainst baseline:")
+    for name, result in results.items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        p95 = result["p95_ms"] / base["p95_ms"] - 1 if base["p95_ms"] else 0
+        rps = result["rps"] / base["rps"] - 1 if base["rps"] else 0
+        flags = []
+        if p95 > tolerance:
+            flags.append("p95")
+        if rps < -tolerance:
+            flags.append("rps")
+        if result["queries_per_request"] > base["queries_per_request"]:
+            flags.append("queries")
+        if result["errors"] > base.get("errors", 0):
+            flags.append("errors")
+        print(f"{name:<28}{p95:>+12.1%} p95{rps:>+12.1%} rps"
+              f"{base['queries_per_request']:>8} -> {result['queries_per_request']} queries"
+              f"{base.get('errors', 0):>6} -> {result['errors']} errors  {' '.join(flags)}")
+        if flags:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API in-process")
+    parser.add_argument("--database-url", default=os.getenv("BENCHMARK_DATABASE_URL", DEFAULT_DATABASE_URL))
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier of the seeded row volumes")
+    parser.add_argument("--requests", type=int, default=500, help="Measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight at once")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests per scenario")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--only", action="append", help="Run only this scenario (repeatable)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="Compare with the baseline, exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative p95 / rps change")
+    args = parser.parse_args()
+
+    # Must be set before models is imported: it builds the engine at import time
+    os.environ["DATABASE_URL"] = args.database_url
+    # Every request comes from the one in-process client, which the rate
+    # limiter would throttle: measure the API, not the limiter
+    for name in ("RATE_LIMIT_RPS", "RATE_LIMIT_IN_FLIGHT", "RATE_LIMIT_HEAVY_RPS", "RATE_LIMIT_HEAVY_IN_FLIGHT"):
+        os.environ[name] = "0"
+    n = seed(args.scale, random.Random(args.seed))
+
+    names = args.only or list(scenarios(n))
+    unknown = [name for name in names if name not in scenarios(n)]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+    print(f"\n{'scenario':<28}" + "".join(f"{header:>12}" for header in HEADERS))
+    results = asyncio.run(run(names, n, args))
+
+    import models
+    meta = {
+        "dialect": models.engine.dialect.name, "scale": args.scale, "requests": args.requests,
+        "concurrency": args.concurrency, "recorded_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2, ensure_ascii=False)
+        print(f"\nBaseline saved to {args.baseline}")
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        differing = [key for key in ("dialect", "scale", "requests", "concurrency") if baseline["meta"].get(key) != meta[key]]
+        if differing:
+            print(f"\nWarning: baseline was recorded with different {', '.join(differing)}")
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
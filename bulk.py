@@ -0,0 +1,184 @@
+from typing import Any, Dict, List
+from fastapi import Body, Depends
+from pydantic import ValidationError
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from cache import cache
+from events import broker
+from schemas import BulkResult
+
+# model -> check(db, rows) for rules that need the database (e.g. booking
+# overlaps). rows are (index, values) pairs, values carry "id" for updates and
+# may be partial (PATCH); the check returns {"index", "detail"[, "status"]}
+# for every row that must not be written.
+ROW_CHECKS = {}
+
+
+def register_row_check(model, check):
+    ROW_CHECKS[model] = check
+
+
+# model -> foreign key columns of the link rows deleted along with its rows.
+# The database can't enforce those foreign keys once the model's table is
+# partitioned (see partitions.py), so the delete paths remove the links.
+LINKED_ROWS = {}
+
+
+def register_linked_rows(model, *columns):
+    LINKED_ROWS[model] = columns
+
+
+def delete_linked_rows(model, ids):
+    # The statements to run before deleting the rows with these ids
+    return [delete(column.table).where(column.in_(ids)) for column in LINKED_ROWS.get(model, ())]
+
+
+# model -> bound(id): an extra condition for statements on one row by id,
+# e.g. the partition key of that row (see partitions.session_date_bound)
+ID_BOUNDS = {}
+
+
+def register_id_bound(model, bound):
+    ID_BOUNDS[model] = bound
+
+
+def by_id(model, item_id):
+    # WHERE conditions selecting one row
+    bound = ID_BOUNDS.get(model)
+    return (model.id == item_id,) if bound is None else (model.id == item_id, bound(item_id))
+
+
+def check_rows(db, model, rows, errors):
+    # Moves the rows rejected by the model's check into errors, returns the rest
+    check = ROW_CHECKS.get(model)
+    if check is None or not rows:
+        return rows
+    rejected = check(db, rows)
+    errors.extend(rejected)
+    failed = {error["index"] for error in rejected}
+    return [(index, row) for index, row in rows if index not in failed]
+
+
+def _validate(items, create_schema, with_id=False):
+    # Validate every item up front so one bad row doesn't hide the others
+    rows, errors = [], []
+    for index, item in enumerate(items):
+        item = dict(item)
+        item_id = item.pop("id", None)
+        if with_id and not isinstance(item_id, int):
+            errors.append({"index": index, "detail": "Integer id is required"})
+            continue
+        try:
+            row = create_schema.model_validate(item).model_dump()
+        except ValidationError as e:
+            errors.append({"index": index, "detail": e.errors(include_url=False, include_context=False)})
+            continue
+        if with_id:
+            row["id"] = item_id
+        rows.append((index, row))
+    return rows, errors
+
+
+def _execute_rows(db, stmt, rows, errors, returning=True):
+    # Fast path: the whole batch as one executemany. If the database rejects it
+    # (a foreign key violation, a value out of range for its column, ...),
+    # replay row by row in savepoints so only the offending items are reported
+    # and the rest still go through. The batch runs in a savepoint too: rolling
+    # back the whole transaction would release the advisory locks taken by
+    # check_rows before the replay.
+    # Returns the rows that were applied and whatever the statement returned.
+    def run(batch):
+        result = db.execute(stmt, [row for _, row in batch])
+        return list(result.scalars()) if returning else []
+
+    if not rows:
+        return [], []
+    try:
+        with db.begin_nested():
+            return rows, run(rows)
+    except DBAPIError:
+        pass
+    applied, returned = [], []
+    for index, row in rows:
+        try:
+            with db.begin_nested():
+                returned.extend(run([(index, row)]))
+            applied.append((index, row))
+        except DBAPIError as e:
+            errors.append({"index": index, "detail": str(e.orig)})
+    return applied, returned
+
+
+def add_bulk_routes(router, prefix, model, schema, create_schema, get_db):
+    # /<prefix>/bulk endpoints taking arrays of the existing *Create schemas;
+    # each call is a single transaction with per-item error reporting
+    namespace = prefix.strip("/")
+
+    @router.post(f"{prefix}bulk", response_model=BulkResult[schema])
+    def bulk_create(items: List[Dict[str, Any]] = Body(...), db: Session = Depends(get_db)):
+        rows, errors = _validate(items, create_schema)
+        rows = check_rows(db, model, rows, errors)
+        _, created = _execute_rows(db, insert(model).returning(model), rows, errors)
+        errors.sort(key=lambda e: e["index"])
+        # Serialize before commit so the expired objects are not reloaded one by one
+        result = {"items": [schema.model_validate(obj) for obj in created], "errors": errors}
+        db.commit()
+        cache.invalidate(namespace)
+        if created:
+            broker.publish(namespace, "created", [item.id for item in result["items"]])
+        return result
+
+    @router.put(f"{prefix}bulk", response_model=BulkResult[schema])
+    def bulk_update(items: List[Dict[str, Any]] = Body(...), db: Session = Depends(get_db)):
+        rows, errors = _validate(items, create_schema, with_id=True)
+        requested = [row["id"] for _, row in rows]
+        existing = set(db.scalars(select(model.id).where(model.id.in_(requested)))) if requested else set()
+        for index, row in rows:
+            if row["id"] not in existing:
+                errors.append({"index": index, "detail": "Not found"})
+        rows = [(index, row) for index, row in rows if row["id"] in existing]
+        rows = check_rows(db, model, rows, errors)
+        # ORM bulk UPDATE by primary key, sent as one executemany
+        rows, _ = _execute_rows(db, update(model), rows, errors, returning=False)
+        ids = [row["id"] for _, row in rows]
+        updated = db.scalars(select(model).where(model.id.in_(ids)).order_by(model.id)).all() if ids else []
+        errors.sort(key=lambda e: e["index"])
+        result = {"items": [schema.model_validate(obj) for obj in updated], "errors": errors}
+        db.commit()
+        cache.invalidate(namespace)
+        if ids:
+            broker.publish(namespace, "updated", ids)
+        return result
+
+    @router.delete(f"{prefix}bulk", response_model=BulkResult[int])
+    def bulk_delete(ids: List[int] = Body(...), db: Session = Depends(get_db)):
+        errors = []
+        stmt = delete(model).where(model.id.in_(ids)).returning(model.id)
+        try:
+            with db.begin_nested():
+                for linked in delete_linked_rows(model, ids) if ids else []:
+                    db.execute(linked)
+                deleted = list(db.scalars(stmt)) if ids else []
+        except DBAPIError:
+            deleted = []
+            for index, item_id in enumerate(ids):
+                try:
+                    with db.begin_nested():
+                        for linked in delete_linked_rows(model, [item_id]):
+                            db.execute(linked)
+                        deleted.extend(db.scalars(delete(model).where(model.id == item_id).returning(model.id)))
+                except DBAPIError as e:
+                    errors.append({"index": index, "detail": str(e.orig)})
+        gone, failed = set(deleted), {e["index"] for e in errors}
+        errors.extend(
+            {"index": index, "detail": "Not found"}
+            for index, item_id in enumerate(ids)
+            if item_id not in gone and index not in failed
+        )
+        errors.sort(key=lambda e: e["index"])
+        db.commit()
+        cache.invalidate(namespace)
+        if deleted:
+            broker.publish(namespace, "deleted", deleted)
+        return {"items": deleted, "errors": errors}
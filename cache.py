@@ -0,0 +1,163 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from fastapi import Response
+from fastapi.concurrency import run_in_threadpool
+
+# Empty: per-process memory cache; redis://...: shared cache (needs the redis package)
+CACHE_URL = os.getenv('CACHE_URL', '')
+CACHE_TTL = int(os.getenv('CACHE_TTL', '300'))
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '1024'))
+
+# Small, rarely changing reference tables whose reads are served from the cache
+CACHED_NAMESPACES = {'masters', 'providedservices', 'responsibles'}
+
+
+class MemoryBackend:
+    # LRU dict with per-entry expiry. It also stands in for Redis in tests and single-worker setups.
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        # Counters live outside the LRU so evicting one can never roll it back
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        # set() only if the key is absent (or expired); True if it was set
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (entry[1] is None or entry[1] >= time.monotonic()):
+                return False
+            self._store(key, value, ttl)
+            return True
+
+    def _store(self, key, value, ttl):
+        self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def counter(self, key):
+        return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class RedisBackend:
+    # Shared across workers; eviction is left to the Redis maxmemory policy
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self._client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self._client.set(key, value, ex=ttl)
+
+    def add(self, key, value, ttl=None):
+        return bool(self._client.set(key, value, ex=ttl, nx=True))
+
+    def delete(self, key):
+        self._client.delete(key)
+
+    def counter(self, key):
+        return int(self._client.get(key) or 0)
+
+    def incr(self, key):
+        return self._client.incr(key)
+
+
+class Cache:
+    # Entries are grouped in namespaces (one per table). Invalidating a namespace
+    # bumps its generation, which is part of every key, so stale entries are
+    # never read again and simply age out.
+    def __init__(self, backend, ttl=CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        # A memory backend is per process: prefix generations with a per-process
+        # token so two workers never report the same generation for different data
+        self._token = uuid.uuid4().hex[:8] if isinstance(backend, MemoryBackend) else 'shared'
+
+    @property
+    def shared(self):
+        # Whether every worker sees the same generations (and invalidations)
+        return not isinstance(self.backend, MemoryBackend)
+
+    def generation(self, namespace):
+        return f'{self._token}.{self.backend.counter(f"gen:{namespace}")}'
+
+    def key(self, namespace, key):
+        return f'cache:{namespace}:{self.generation(namespace)}:{key}'
+
+    def get(self, full_key):
+        return self.backend.get(full_key)
+
+    def set(self, full_key, value):
+        self.backend.set(full_key, value, self.ttl)
+
+    def invalidate(self, namespace):
+        self.backend.incr(f'gen:{namespace}')
+
+
+cache = Cache(RedisBackend(CACHE_URL) if CACHE_URL else MemoryBackend())
+
+
+async def off_loop(backend, call, *args):
+    # Backend calls from async code (handlers, middlewares): the Redis client
+    # blocks on the network, so it runs in the threadpool; the memory backend
+    # is a dict lookup and runs inline
+    if isinstance(backend, MemoryBackend):
+        return call(*args)
+    return await run_in_threadpool(call, *args)
+
+
+def cached_json(namespace, key, produce):
+    # Serve a JSON body from the cache, building (and storing) it on a miss.
+    # Hits skip both the database and response validation.
+    # The key is taken before reading the database, so a write that lands
+    # meanwhile stores this result under an already outdated generation
+    full_key = cache.key(namespace, key)
+    body = cache.get(full_key)
+    if body is None:
+        body = produce()
+        cache.set(full_key, body)
+    return Response(body, media_type="application/json")
+
+
+async def cached_json_async(namespace, key, produce):
+    # Same as cached_json for the async handlers; produce is a coroutine function
+    def lookup():
+        full_key = cache.key(namespace, key)
+        return full_key, cache.get(full_key)
+
+    full_key, body = await off_loop(cache.backend, lookup)
+    if body is None:
+        body = await produce()
+        await off_loop(cache.backend, cache.set, full_key, body)
+    return Response(body, media_type="application/json")
@@ -0,0 +1,129 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+from bulk import ID_BOUNDS, add_bulk_routes, by_id, check_rows, delete_linked_rows
+from cache import CACHED_NAMESPACES, cache, cached_json
+from events import broker
+from filters import ListQuery, list_query
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, json_response, paginate, stream_ndjson
+from replicas import use_primary
+from schemas import Page, partial
+from transfer import add_transfer_routes
+
+
+# Resources whose DELETE answered {"message": ...} before the generic router;
+# the others answered {"detail": ...}. Each keeps its shape for existing clients.
+DELETE_MESSAGE_NAMESPACES = {"clients", "masters", "providedservices"}
+
+
+def delete_response(namespace, label):
+    if namespace in DELETE_MESSAGE_NAMESPACES:
+        return {"message": f"{label} deleted successfully"}
+    return {"detail": f"{label} deleted"}
+
+
+def check_patch(model, data):
+    # An explicit null is only allowed for nullable columns
+    invalid = [key for key, value in data.items() if value is None and not model.__table__.c[key].nullable]
+    if invalid:
+        raise HTTPException(status_code=422, detail=f"Field(s) cannot be null: {', '.join(invalid)}")
+
+
+def check_write(db, model, item_id, data):
+    # The model's row check (see bulk.ROW_CHECKS) for a single create / update
+    errors = []
+    check_rows(db, model, [(0, data if item_id is None else {**data, "id": item_id})], errors)
+    if errors:
+        raise HTTPException(status_code=errors[0].get("status", 422), detail=errors[0]["detail"])
+
+
+def crud_router(prefix, model, schema, create_schema, label, get_db):
+    # List / get / create / replace / patch / delete (+ /bulk) for one model.
+    # Reads by id go through Session.get (identity map first), every write is a
+    # single INSERT / UPDATE / DELETE ... RETURNING, and the returned row is
+    # serialized before commit so nothing is reloaded afterwards.
+    router = APIRouter()
+    namespace = prefix.strip("/")
+    cached = namespace in CACHED_NAMESPACES
+    patch_schema = partial(create_schema)
+
+    # Registered first so /<resource>/bulk etc. aren't taken for an {id}
+    add_bulk_routes(router, prefix, model, schema, create_schema, get_db)
+    add_transfer_routes(router, prefix, model, schema, create_schema, get_db)
+
+    def get_or_404(db, item_id):
+        if model in ID_BOUNDS:
+            item = db.scalars(select(model).where(*by_id(model, item_id))).one_or_none()
+        else:
+            item = db.get(model, item_id)
+        if item is None:
+            raise HTTPException(status_code=404, detail=f"{label} not found")
+        return item
+
+    def write(db, stmt, action):
+        item = db.scalars(stmt.returning(model)).one_or_none()
+        if item is None:
+            raise HTTPException(status_code=404, detail=f"{label} not found")
+        result = schema.model_validate(item)
+        db.commit()
+        cache.invalidate(namespace)
+        broker.publish(namespace, action, [result.id], result.model_dump(mode="json"))
+        return result
+
+    @router.get(prefix, response_model=Page[schema])
+    def get_all(
+        after_id: Optional[int] = None,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        stream: bool = False,
+        query: ListQuery = Depends(list_query(model)),
+        db: Session = Depends(get_db),
+    ):
+        if stream:
+            return stream_ndjson(model, schema, after_id, query)
+        if cached:
+            use_primary(db)
+            return cached_json(namespace, f"list:{query.cache_key}", lambda: paginate(db, model, schema, after_id, limit, query))
+        return json_response(paginate(db, model, schema, after_id, limit, query))
+
+    @router.get(prefix + "{id}", response_model=schema)
+    def get_one(id: int, db: Session = Depends(get_db)):
+        if cached:
+            use_primary(db)
+            return cached_json(namespace, f"item:{id}", lambda: schema.model_validate(get_or_404(db, id)).model_dump_json())
+        return get_or_404(db, id)
+
+    @router.post(prefix, response_model=schema)
+    def create(item: create_schema, db: Session = Depends(get_db)):
+        data = item.model_dump()
+        check_write(db, model, None, data)
+        return write(db, insert(model).values(**data), "created")
+
+    @router.put(prefix + "{id}", response_model=schema)
+    def replace(id: int, item: create_schema, db: Session = Depends(get_db)):
+        data = item.model_dump()
+        check_write(db, model, id, data)
+        return write(db, update(model).where(*by_id(model, id)).values(**data), "updated")
+
+    @router.patch(prefix + "{id}", response_model=schema)
+    def patch(id: int, item: patch_schema, db: Session = Depends(get_db)):
+        data = item.model_dump(exclude_unset=True)
+        if not data:
+            return get_or_404(db, id)
+        check_patch(model, data)
+        check_write(db, model, id, data)
+        return write(db, update(model).where(*by_id(model, id)).values(**data), "updated")
+
+    @router.delete(prefix + "{id}", response_model=dict)
+    def remove(id: int, db: Session = Depends(get_db)):
+        for linked in delete_linked_rows(model, [id]):
+            db.execute(linked)
+        deleted = db.scalars(delete(model).where(*by_id(model, id)).returning(model.id)).one_or_none()
+        if deleted is None:
+            raise HTTPException(status_code=404, detail=f"{label} not found")
+        db.commit()
+        cache.invalidate(namespace)
+        broker.publish(namespace, "deleted", [id])
+        return delete_response(namespace, label)
+
+    return router
@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+
+
+def _env_bool(name, default):
+    return os.getenv(name, default).lower() in ('1', 'true', 'yes')
+
+
+# Pool settings, tunable from .env
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+# Recycle connections older than this many seconds (-1 disables)
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+# Test connections on checkout so stale ones after a failover are replaced, not handed out
+DB_POOL_PRE_PING = _env_bool('DB_POOL_PRE_PING', 'true')
+# Running behind PgBouncer in transaction mode: let it do the pooling and
+# don't rely on server-side prepared statements surviving between transactions
+DB_EXTERNAL_POOLER = _env_bool('DB_EXTERNAL_POOLER', 'false')
+
+
+class _TimedCheckout:
+    # Records how long checkouts wait for a connection (including opening a new one)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkout_count = 0
+        self.checkout_wait_seconds = 0.0
+        self.checkout_wait_max_seconds = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkout_count += 1
+                self.checkout_wait_seconds += waited
+                self.checkout_wait_max_seconds = max(self.checkout_wait_max_seconds, waited)
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+class TimedNullPool(_TimedCheckout, NullPool):
+    pass
+
+
+def engine_options(is_async=False):
+    # Keyword arguments for create_engine / create_async_engine
+    options = {'pool_pre_ping': DB_POOL_PRE_PING}
+    if DB_EXTERNAL_POOLER:
+        options['poolclass'] = TimedNullPool
+        if is_async:
+            # asyncpg caches prepared statements per connection, which breaks
+            # when PgBouncer hands the next transaction a different server connection
+            options['connect_args'] = {'statement_cache_size': 0, 'prepared_statement_cache_size': 0}
+        return options
+    options.update(
+        poolclass=TimedAsyncAdaptedQueuePool if is_async else TimedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+    )
+    return options
+
+
+def pool_stats(pool):
+    # Gauges for a pool: connections in use / idle / beyond pool_size, and checkout waits
+    stats = {}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            idle=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+        )
+    if isinstance(pool, _TimedCheckout):
+        with pool._stats_lock:
+            stats.update(
+                checkout_count=pool.checkout_count,
+                checkout_wait_seconds=pool.checkout_wait_seconds,
+                checkout_wait_max_seconds=pool.checkout_wait_max_seconds,
+            )
+    return stats
@@ -0,0 +1,82 @@
+import hashlib
+from starlette.datastructures import Headers, MutableHeaders
+from cache import cache, off_loop
+from replicas import reads_from_replica
+
+# List endpoint path -> cache namespace whose generation versions the collection
+COLLECTION_PATHS = {}
+
+
+def register_collection(path, namespace):
+    COLLECTION_PATHS[path] = namespace
+
+
+def _matches(if_none_match, etag):
+    # Weak comparison, as required for If-None-Match
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in tags)
+
+
+async def _not_modified(send, etag):
+    await send({"type": "http.response.start", "status": 304, "headers": [(b"etag", etag.encode())]})
+    await send({"type": "http.response.body", "body": b""})
+
+
+class ETagMiddleware:
+    # Conditional GET support.
+    # - List endpoints: the ETag is the table's cache generation (bumped by every
+    #   write handler) plus the query string, so a matching If-None-Match is
+    #   answered with 304 before the handler runs: no query, no serialization.
+    # - Other JSON GETs (single items): the ETag is a hash of the response body,
+    #   which saves the transfer. Lists read from a replica are hashed too: the
+    #   generation tracks the primary, and a lagging replica's body must not
+    #   be tagged with it. So are all lists without a shared cache (CACHE_URL):
+    #   a worker's memory backend never sees the writes handled by the others,
+    #   and its generation would keep answering 304 after them.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            return await self.app(scope, receive, send)
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        namespace = COLLECTION_PATHS.get(scope["path"])
+        if namespace is not None and cache.shared and not reads_from_replica.get():
+            query = hashlib.blake2b(scope.get("query_string", b""), digest_size=6).hexdigest()
+            generation = await off_loop(cache.backend, cache.generation, namespace)
+            etag = f'W/"{namespace}.{generation}.{query}"'
+            if if_none_match and _matches(if_none_match, etag):
+                return await _not_modified(send, etag)
+
+            async def send_with_etag(message):
+                if message["type"] == "http.response.start" and message["status"] == 200:
+                    MutableHeaders(scope=message).append("etag", etag)
+                await send(message)
+
+            return await self.app(scope, receive, send_with_etag)
+
+        start = None
+        chunks = []
+
+        async def send_hashed(message):
+            nonlocal start
+            if start is None and message["type"] == "http.response.start":
+                content_type = Headers(raw=message["headers"]).get("content-type", "")
+                if message["status"] == 200 and content_type.startswith("application/json"):
+                    # Hold the response until the whole body is known
+                    start = message
+                    return
+            if start is None or message["type"] != "http.response.body":
+                return await send(message)
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            body = b"".join(chunks)
+            etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+            if if_none_match and _matches(if_none_match, etag):
+                return await _not_modified(send, etag)
+            MutableHeaders(scope=start).append("etag", etag)
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_hashed)
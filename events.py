@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import os
+import queue
+import select
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+import orjson
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# memory: events reach the subscribers of this process only.
+# postgres: events go through NOTIFY on EVENTS_CHANNEL, so subscribers of
+# every worker / instance listening on the database receive them.
+EVENTS_BACKEND = os.getenv('EVENTS_BACKEND', 'memory')
+EVENTS_CHANNEL = os.getenv('EVENTS_CHANNEL', 'changes')
+# Seconds between SSE keep-alive comments, so proxies don't drop idle streams
+EVENTS_KEEPALIVE = float(os.getenv('EVENTS_KEEPALIVE', '15'))
+# Events buffered per subscriber; a client that falls further behind gets a resync
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+# NOTIFY payloads are limited to 8000 bytes: events are split into chunks of
+# ids, and one still too big is sent without its item
+MAX_NOTIFY_PAYLOAD = 7900
+NOTIFY_IDS_PER_EVENT = 500
+
+RESYNC = {"action": "resync"}
+
+
+class Subscription:
+    def __init__(self, topics):
+        # None means every topic
+        self.topics = topics
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def deliver(self, event):
+        if event is not RESYNC and self.topics is not None and event.get("topic") not in self.topics:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Missed events can't be replayed: tell the client to refetch instead
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+
+class Broker:
+    # Fan-out of change events to SSE / WebSocket subscribers. publish() is
+    # called from the write handlers, which run in the threadpool or on the
+    # event loop; delivery always happens on the loop.
+    def __init__(self):
+        self._loop = None
+        self._subscriptions = set()
+        self._listener = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        if EVENTS_BACKEND == 'postgres':
+            self._listener = PostgresListener(self._deliver_threadsafe)
+            self._listener.start()
+
+    def stop(self):
+        if self._listener is not None:
+            self._listener.stop()
+        self._loop = None
+
+    def publish(self, topic, action, ids=(), item=None):
+        event = {"topic": topic, "action": action, "ids": list(ids)}
+        if item is not None:
+            event["item"] = item
+        if self._listener is not None:
+            self._listener.notify(event)
+        else:
+            self._deliver_threadsafe(event)
+
+    def _deliver_threadsafe(self, event):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._deliver, event)
+
+    def _deliver(self, event):
+        for subscription in list(self._subscriptions):
+            subscription.deliver(event)
+
+    @contextmanager
+    def subscribe(self, topics=None):
+        subscription = Subscription(topics)
+        self._subscriptions.add(subscription)
+        try:
+            yield subscription
+        finally:
+            self._subscriptions.discard(subscription)
+
+
+def _notify_payloads(event):
+    ids = event.get("ids", [])
+    for start in range(0, max(len(ids), 1), NOTIFY_IDS_PER_EVENT):
+        part = {**event, "ids": ids[start:start + NOTIFY_IDS_PER_EVENT]}
+        if len(ids) > NOTIFY_IDS_PER_EVENT:
+            part.pop("item", None)  # the item of a single-row write only
+        payload = orjson.dumps(part)
+        if len(payload) > MAX_NOTIFY_PAYLOAD:
+            payload = orjson.dumps({key: value for key, value in part.items() if key != "item"})
+        yield payload.decode()
+
+
+class PostgresListener:
+    # LISTEN / NOTIFY on a dedicated connection (outside the pool), in a thread.
+    # Outgoing events are queued here too, so publishing never blocks a handler.
+    def __init__(self, deliver):
+        self._deliver = deliver
+        self._outbox = queue.Queue()
+        self._wakeup_read, self._wakeup_write = os.pipe()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="events-listener", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        os.write(self._wakeup_write, b"x")
+        self._thread.join(timeout=5)
+
+    def notify(self, event):
+        for payload in _notify_payloads(event):
+            self._outbox.put(payload)
+        os.write(self._wakeup_write, b"x")
+
+    def _connect(self):
+        from models import engine
+        cargs, cparams = engine.dialect.create_connect_args(engine.url)
+        connection = engine.dialect.connect(*cargs, **cparams)
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {EVENTS_CHANNEL}")
+        return connection
+
+    def _run(self):
+        connected_before = False
+        while not self._stopping.is_set():
+            try:
+                connection = self._connect()
+            except Exception:
+                logger.exception("Events listener could not connect, retrying")
+                time.sleep(1)
+                continue
+            if connected_before:
+                # Notifications sent while disconnected are lost
+                self._deliver(RESYNC)
+            connected_before = True
+            try:
+                self._serve(connection)
+            except Exception:
+                logger.exception("Events listener connection lost, reconnecting")
+            finally:
+                connection.close()
+
+    def _serve(self, connection):
+        while not self._stopping.is_set():
+            readable, _, _ = select.select([connection, self._wakeup_read], [], [])
+            if self._wakeup_read in readable:
+                os.read(self._wakeup_read, 4096)
+            with connection.cursor() as cursor:
+                while not self._outbox.empty():
+                    cursor.execute("SELECT pg_notify(%s, %s)", (EVENTS_CHANNEL, self._outbox.get()))
+            connection.poll()
+            while connection.notifies:
+                self._deliver(orjson.loads(connection.notifies.pop(0).payload))
+
+
+broker = Broker()
+
+
+def notify(conn, topic, action, ids=()):
+    # For processes without a running broker (manage.py commands): sends the
+    # event with NOTIFY on conn, so app workers get it once conn's transaction
+    # commits. Only with the postgres backend; the memory backend's
+    # subscribers live in the app workers and can't be reached from outside.
+    if EVENTS_BACKEND != 'postgres':
+        return
+    for payload in _notify_payloads({"topic": topic, "action": action, "ids": list(ids)}):
+        conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": EVENTS_CHANNEL, "payload": payload})
+
+
+def _parse_topics(topics, known):
+    if not topics:
+        return None
+    requested = {topic.strip() for topic in topics.split(",") if topic.strip()}
+    unknown = requested - set(known)
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown topic(s): {', '.join(sorted(unknown))}")
+    return requested
+
+
+def events_router(known_topics):
+    # Change feed: {"topic", "action", "ids"[, "item"]} per write, where topic
+    # is the table, action is created / updated / deleted / imported (or
+    # expiring, from the warranty sweeps, or archived, from archive-sessions
+    # with the postgres backend) and item is the written row for
+    # single-row writes. {"action": "resync"} means
+    # events were missed and the client should refetch.
+    router = APIRouter()
+    topics_query = Query(None, description="Comma-separated tables to follow; all by default")
+
+    @router.get("/events")
+    async def server_sent_events(topics: Optional[str] = topics_query):
+        requested = _parse_topics(topics, known_topics)
+
+        async def stream():
+            with broker.subscribe(requested) as subscription:
+                yield b"retry: 3000\n\n"
+                while True:
+                    try:
+                        event = await asyncio.wait_for(subscription.queue.get(), EVENTS_KEEPALIVE)
+                    except asyncio.TimeoutError:
+                        yield b": keep-alive\n\n"
+                        continue
+                    yield b"data: " + orjson.dumps(event) + b"\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    @router.websocket("/events/ws")
+    async def websocket_events(websocket: WebSocket, topics: Optional[str] = None):
+        try:
+            requested = _parse_topics(topics, known_topics)
+        except HTTPException as e:
+            return await websocket.close(code=1008, reason=e.detail)
+        await websocket.accept()
+        with broker.subscribe(requested) as subscription:
+            # The feed is one-way; the client is only read to notice it closing
+            receiving, sending = asyncio.ensure_future(websocket.receive()), None
+            try:
+                while True:
+                    if sending is None:
+                        sending = asyncio.ensure_future(subscription.queue.get())
+                    done, _ = await asyncio.wait({sending, receiving}, return_when=asyncio.FIRST_COMPLETED)
+                    if sending in done:
+                        await websocket.send_text(orjson.dumps(sending.result()).decode())
+                        sending = None
+                    if receiving in done:
+                        if receiving.result()["type"] == "websocket.disconnect":
+                            return
+                        receiving = asyncio.ensure_future(websocket.receive())
+            except WebSocketDisconnect:
+                pass
+            finally:
+                receiving.cancel()
+                if sending is not None:
+                    sending.cancel()
+
+    return router
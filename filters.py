@@ -0,0 +1,131 @@
+import base64
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+import orjson
+from fastapi import HTTPException, Query, Request
+from sqlalchemy import Boolean, DateTime, Enum, Integer, String, literal, tuple_
+
+# Query parameters of the list endpoints that are not column filters
+RESERVED_PARAMS = {"after_id", "cursor", "limit", "stream", "sort"}
+
+RANGE_OPS = {"gt": "__gt__", "gte": "__ge__", "lt": "__lt__", "lte": "__le__"}
+
+
+@dataclass
+class ListQuery:
+    # Parsed ?<column>[__op]=value filters and ?sort=[-]<column> for one list request
+    model: type
+    filters: list = field(default_factory=list)
+    sort_column: Optional[object] = None
+    descending: bool = False
+    # (sort value, id) of the last row of the previous page, from ?cursor=
+    cursor: Optional[tuple] = None
+    # Raw query string, identifies the result for caching
+    cache_key: str = ""
+
+
+def _parse_value(column, raw):
+    column_type = column.type
+    if isinstance(column_type, Boolean):
+        if raw.lower() in ("true", "1"):
+            return True
+        if raw.lower() in ("false", "0"):
+            return False
+        raise ValueError("expected true or false")
+    if isinstance(column_type, Integer):
+        return int(raw)
+    if isinstance(column_type, DateTime):
+        return datetime.fromisoformat(raw)
+    return raw
+
+
+def _filter(model, name, raw):
+    # <column>=v (equality), <column>__gt/gte/lt/lte=v (ranges on numbers and
+    # dates), <column>__prefix=v (string prefix, an index range scan on Postgres
+    # thanks to text_pattern_ops indexes)
+    column_name, _, op = name.partition("__")
+    column = model.__table__.c.get(column_name)
+    if column is None:
+        raise HTTPException(status_code=422, detail=f"Unknown filter: {name}")
+    try:
+        if op == "":
+            return column == _parse_value(column, raw)
+        if op in RANGE_OPS and isinstance(column.type, (Integer, DateTime)):
+            return getattr(column, RANGE_OPS[op])(_parse_value(column, raw))
+        if op == "prefix" and isinstance(column.type, String) and not isinstance(column.type, Enum):
+            return column.startswith(raw, autoescape=True)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid value for {name}: {e}")
+    raise HTTPException(status_code=422, detail=f"Unsupported filter: {name}")
+
+
+def encode_cursor(value, row_id):
+    # next_cursor of a sorted list: the last row's (sort value, id), so the next
+    # page starts right after it even if that row is deleted or changed meanwhile
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(orjson.dumps([value, row_id])).decode().rstrip("=")
+
+
+def decode_cursor(column, raw):
+    try:
+        value, row_id = orjson.loads(base64.urlsafe_b64decode(raw + "=" * (-len(raw) % 4)))
+        if isinstance(column.type, DateTime):
+            value = datetime.fromisoformat(value)
+        for column_type, expected in ((DateTime, datetime), (Boolean, bool), (Integer, int), (String, str)):
+            if isinstance(column.type, column_type):
+                break
+        # Exact types: a bool is not an int here
+        if type(value) is not expected or type(row_id) is not int:
+            raise ValueError
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+    return value, row_id
+
+
+def list_query(model):
+    # Dependency factory: builds a ListQuery from the request's query string
+    def dependency(
+        request: Request,
+        sort: Optional[str] = Query(None, description="Column to sort by, '-' prefix for descending"),
+        cursor: Optional[str] = Query(None, description="next_cursor of the previous page of a sorted list"),
+    ):
+        query = ListQuery(model, cache_key=request.url.query)
+        for name, raw in request.query_params.multi_items():
+            if name not in RESERVED_PARAMS:
+                query.filters.append(_filter(model, name, raw))
+        if sort:
+            column = model.__table__.c.get(sort.lstrip("-"))
+            # Nullable columns can't be used in the (column, id) keyset comparison
+            if column is None or column.nullable:
+                raise HTTPException(status_code=422, detail=f"Cannot sort by: {sort}")
+            query.sort_column, query.descending = column, sort.startswith("-")
+        if cursor is not None:
+            if query.sort_column is None:
+                raise HTTPException(status_code=422, detail="cursor pages sorted lists; use after_id")
+            query.cursor = decode_cursor(query.sort_column, cursor)
+        return query
+
+    return dependency
+
+
+def apply_list_query(stmt, query, after_id):
+    # Adds filters, ordering and the keyset condition to a SELECT of query.model.
+    # With a sort column the keyset is (column, id), taken from query.cursor.
+    model = query.model
+    stmt = stmt.where(*query.filters)
+    if query.sort_column is None:
+        if after_id is not None:
+            stmt = stmt.where(model.id > after_id)
+        return stmt.order_by(model.id)
+    column = query.sort_column
+    if after_id is not None:
+        raise HTTPException(status_code=422, detail="Sorted lists are paged with cursor, not after_id")
+    if query.cursor is not None:
+        value, last_id = query.cursor
+        keyset, cursor = tuple_(column, model.id), tuple_(literal(value, column.type), literal(last_id, model.id.type))
+        stmt = stmt.where(keyset < cursor if query.descending else keyset > cursor)
+    if query.descending:
+        return stmt.order_by(column.desc(), model.id.desc())
+    return stmt.order_by(column, model.id)
@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import os
+import orjson
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from cache import CACHE_URL, MemoryBackend, RedisBackend, off_loop
+
+# How long a response is kept for retries with the same Idempotency-Key
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', '86400'))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', '10000'))
+# Bodies are buffered to fingerprint the request, so keys are only accepted on small ones
+IDEMPOTENCY_MAX_BODY = int(os.getenv('IDEMPOTENCY_MAX_BODY', str(1024 * 1024)))
+# A request holding a key longer than this is considered dead and the key freed
+IN_FLIGHT_TTL = 60
+
+MAX_KEY_LENGTH = 255
+
+
+def _pack(fingerprint, status, headers, body):
+    meta = {"fingerprint": fingerprint, "status": status, "headers": [[k.decode("latin-1"), v.decode("latin-1")] for k, v in headers]}
+    return orjson.dumps(meta) + b"\n" + body
+
+
+def _unpack(stored):
+    meta, _, body = stored.partition(b"\n")
+    return orjson.loads(meta), body
+
+
+async def _read_body(receive):
+    # The whole request body, or None once it grows past IDEMPOTENCY_MAX_BODY
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunks.append(message.get("body", b""))
+        size += len(chunks[-1])
+        if size > IDEMPOTENCY_MAX_BODY:
+            return None
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+class IdempotencyMiddleware:
+    # POST requests carrying an Idempotency-Key header run at most once per key:
+    # - a retry after completion gets the stored response (Idempotent-Replayed: true),
+    # - a retry while the first attempt is still running in this process waits
+    #   for it and gets the same response; in another worker it gets a 409,
+    # - reusing a key for a different request (path or body) is a 422.
+    # 5xx responses are not stored, so those can be retried. The store is the
+    # shared Redis when CACHE_URL is set, else a per-process LRU.
+    def __init__(self, app, backend=None):
+        self.app = app
+        self.store = backend or (RedisBackend(CACHE_URL) if CACHE_URL else MemoryBackend(IDEMPOTENCY_MAX_ENTRIES))
+        # store key -> (fingerprint, future resolving to the packed response or None)
+        self._in_flight = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return await self.app(scope, receive, send)
+        key = Headers(scope=scope).get("idempotency-key")
+        if key is None:
+            return await self.app(scope, receive, send)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return await _error(scope, receive, send, 422, f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+        body = await _read_body(receive)
+        if body is None:
+            return await _error(scope, receive, send, 413, f"Idempotency-Key is only supported on bodies up to {IDEMPOTENCY_MAX_BODY} bytes")
+
+        fingerprint = hashlib.blake2b(
+            b"\0".join([scope["path"].encode(), scope.get("query_string", b""), body]), digest_size=16
+        ).hexdigest()
+        store_key = f"idempotency:{key}"
+
+        while True:
+            stored = await off_loop(self.store, self.store.get, store_key)
+            if stored is not None:
+                return await self._replay(scope, receive, send, stored, fingerprint)
+            in_flight = self._in_flight.get(store_key)
+            if in_flight is None:
+                break
+            if in_flight[0] != fingerprint:
+                return await _error(scope, receive, send, 422, "Idempotency-Key was already used for a different request")
+            # Collapse into the running request; if it fails with a 5xx, try again
+            stored = await asyncio.shield(in_flight[1])
+            if stored is not None:
+                return await self._replay(scope, receive, send, stored, fingerprint)
+
+        lock_key = f"{store_key}:lock"
+        # Registered before taking the lock, which may yield to the loop, so a
+        # retry arriving meanwhile in this process collapses into this one
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[store_key] = (fingerprint, future)
+        if not await off_loop(self.store, self.store.add, lock_key, fingerprint, IN_FLIGHT_TTL):
+            del self._in_flight[store_key]
+            future.set_result(None)
+            return await _error(scope, receive, send, 409, "A request with this Idempotency-Key is in progress", {"Retry-After": "1"})
+        start, chunks = None, []
+
+        async def replay_body():
+            nonlocal body
+            if body is None:
+                return await receive()
+            message, body = {"type": "http.request", "body": body, "more_body": False}, None
+            return message
+
+        async def capture(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        packed = None
+        try:
+            await self.app(scope, replay_body, capture)
+            if start is not None and start["status"] < 500:
+                packed = _pack(fingerprint, start["status"], start.get("headers", []), b"".join(chunks))
+                await off_loop(self.store, self.store.set, store_key, packed, IDEMPOTENCY_TTL)
+        finally:
+            del self._in_flight[store_key]
+            future.set_result(packed)
+            await off_loop(self.store, self.store.delete, lock_key)
+
+    async def _replay(self, scope, receive, send, stored, fingerprint):
+        meta, body = _unpack(stored)
+        if meta["fingerprint"] != fingerprint:
+            return await _error(scope, receive, send, 422, "Idempotency-Key was already used for a different request")
+        headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in meta["headers"]]
+        headers.append((b"idempotent-replayed", b"true"))
+        await send({"type": "http.response.start", "status": meta["status"], "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+
+async def _error(scope, receive, send, status, detail, headers=None):
+    await JSONResponse({"detail": detail}, status_code=status, headers=headers)(scope, receive, send)
@@ -1,12 +1,18 @@
-from fastapi import FastAPI, Depends, HTTPException
-from sqlalchemy.orm import Session
-from sqlalchemy.sql.functions import func
-from typing import List
+# First import: starts the clock for the import time reported by /readyz
+from startup import (
+    health_router, prewarm_async_pool, prewarm_pool, readiness,
+    warm_statements, warm_statements_async,
+)
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, FastAPI
+from fastapi.responses import PlainTextResponse
 from models import (
-    SessionLocal,
+    DB_ASYNC, AsyncSessionLocal, SessionLocal, async_engine, engine, missing_id_sequences, partitioned_tables, replicas, sync_id_sequences,
     Clients, Masters, Providedservices,
     Repairparts, Responsibles, Vehicles,
-    Warrantiescards, Repairsessions
+    Warrantiescards, Repairsessions, RepairsessionsProvidedservices, RepairsessionsRepairparts, RevenueDaily, JobState
 )
 from schemas import (
     Client, ClientCreate,
@@ -18,9 +24,68 @@ from schemas import (
     WarrantyCard, WarrantyCardCreate,
     RepairSession, RepairSessionCreate
 )
+from async_crud import async_crud_router
+from bulk import add_bulk_routes, register_id_bound, register_linked_rows, register_row_check
+from crud import crud_router
+from db_pool import pool_stats
+from etag import ETagMiddleware, register_collection
+from events import broker, events_router
+from idempotency import IdempotencyMiddleware
+from metrics import MetricsMiddleware, render as render_metrics
+from partitions import PARTITION_MAINTENANCE_INTERVAL, run_partition_maintenance, session_date_bound
+from ratelimit import RateLimitMiddleware
+from replicas import ReplicaRoutingMiddleware
+from reports import reports_router
+from scheduling import check_bookings, scheduling_router
+from search import search_router
+from transfer import add_transfer_routes
+from warranties import WARRANTY_SWEEP_INTERVAL, run_expiry_sweeps, warranty_router
+from workorders import workorder_router
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Everything that needs the database happens here, before the worker takes
+    # traffic: a bad URL or credentials fail the startup instead of the first
+    # request, and the first requests find open connections and compiled statements
+    started = time.perf_counter()
+    # Make sure every table has its id sequence before serving inserts. Only a
+    # catalog check once they exist (python manage.py sync-sequences); the DDL
+    # runs on the first start after an upgrade
+    if missing_id_sequences(engine):
+        sync_id_sequences(engine)
+    # Once repairsessions is partitioned, a session read or written by id is
+    # looked up in its month's partition only
+    with engine.connect() as conn:
+        if Repairsessions.__tablename__ in partitioned_tables(conn):
+            register_id_bound(Repairsessions, session_date_bound)
+    # The revenue summary reads as empty, not as an error, until its first refresh
+    RevenueDaily.__table__.create(engine, checkfirst=True)
+    JobState.__table__.create(engine, checkfirst=True)
+    prewarm_pool(engine)
+    warm_statements(SessionLocal, RESOURCES)
+    if async_engine is not None:
+        await prewarm_async_pool(async_engine)
+        await warm_statements_async(AsyncSessionLocal, RESOURCES)
+    broker.start()
+    replicas.start()
+    sweeps = asyncio.create_task(run_expiry_sweeps()) if WARRANTY_SWEEP_INTERVAL else None
+    partitioning = asyncio.create_task(run_partition_maintenance()) if PARTITION_MAINTENANCE_INTERVAL else None
+    readiness.started(time.perf_counter() - started)
+    yield
+    readiness.ready = False
+    for task in (sweeps, partitioning):
+        if task is not None:
+            task.cancel()
+    broker.stop()
+    replicas.stop()
+    if async_engine is not None:
+        await async_engine.dispose()
+    for replica in replicas.async_engines:
+        await replica.dispose()
+
 
 # Initialize FastAPI
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Dependency to get DB session for each request
 def get_db():
@@ -30,336 +95,107 @@ def get_db():
     finally:
         db.close()
 
+# Same for the AsyncSession used by the async handlers (DB_ASYNC)
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
 
-# --- CRUD Endpoints for Clients ---
-@app.get("/clients/", response_model=List[Client])
-def get_all_clients(db: Session = Depends(get_db)):
-    return db.query(Clients).all()
-
-@app.get("/clients/{client_id}", response_model=Client)
-def get_client(client_id: int, db: Session = Depends(get_db)):
-    client = db.query(Clients).filter(Clients.id == client_id).first()
-    if client is None:
-        raise HTTPException(status_code=404, detail="Client not found")
-    return client
-
-@app.post("/clients/", response_model=Client)
-def create_client(client: ClientCreate, db: Session = Depends(get_db)):
-    # Retrieve the latest client ID and add 1
-    latest_client_id = db.query(func.max(Clients.id)).scalar() or 0
-    new_client = Clients(id=latest_client_id + 1, **client.dict())
-    db.add(new_client)
-    db.commit()
-    db.refresh(new_client)
-    return new_client
-
-@app.put("/clients/{client_id}", response_model=Client)
-def update_client(client_id: int, client: ClientCreate, db: Session = Depends(get_db)):
-    db_client = db.query(Clients).filter(Clients.id == client_id).first()
-    if db_client is None:
-        raise HTTPException(status_code=404, detail="Client not found")
-    for key, value in client.dict().items():
-        setattr(db_client, key, value)
-    db.commit()
-    db.refresh(db_client)
-    return db_client
-
-@app.delete("/clients/{client_id}", response_model=dict)
-def delete_client(client_id: int, db: Session = Depends(get_db)):
-    db_client = db.query(Clients).filter(Clients.id == client_id).first()
-    if db_client is None:
-        raise HTTPException(status_code=404, detail="Client not found")
-    db.delete(db_client)
-    db.commit()
-    return {"message": "Client deleted successfully"}
-
-
-# --- CRUD Endpoints for Masters ---
-@app.get("/masters/", response_model=List[Master])
-def get_all_masters(db: Session = Depends(get_db)):
-    return db.query(Masters).all()
-
-@app.get("/masters/{master_id}", response_model=Master)
-def get_master(master_id: int, db: Session = Depends(get_db)):
-    master = db.query(Masters).filter(Masters.id == master_id).first()
-    if master is None:
-        raise HTTPException(status_code=404, detail="Master not found")
-    return master
-
-@app.post("/masters/", response_model=Master)
-def create_master(master: MasterCreate, db: Session = Depends(get_db)):
-    # Retrieve the latest master ID and add 1
-    latest_master_id = db.query(func.max(Masters.id)).scalar() or 0
-    new_master = Masters(id=latest_master_id + 1, **master.dict())
-    db.add(new_master)
-    db.commit()
-    db.refresh(new_master)
-    return new_master
-
-@app.put("/masters/{master_id}", response_model=Master)
-def update_master(master_id: int, master: MasterCreate, db: Session = Depends(get_db)):
-    db_master = db.query(Masters).filter(Masters.id == master_id).first()
-    if db_master is None:
-        raise HTTPException(status_code=404, detail="Master not found")
-    for key, value in master.dict().items():
-        setattr(db_master, key, value)
-    db.commit()
-    db.refresh(db_master)
-    return db_master
-
-@app.delete("/masters/{master_id}", response_model=dict)
-def delete_master(master_id: int, db: Session = Depends(get_db)):
-    db_master = db.query(Masters).filter(Masters.id == master_id).first()
-    if db_master is None:
-        raise HTTPException(status_code=404, detail="Master not found")
-    db.delete(db_master)
-    db.commit()
-    return {"message": "Master deleted successfully"}
-
-
-# --- CRUD Endpoints for Provided Services ---
-@app.get("/providedservices/", response_model=List[ProvidedService])
-def get_all_providedservices(db: Session = Depends(get_db)):
-    return db.query(Providedservices).all()
-
-@app.get("/providedservices/{service_id}", response_model=ProvidedService)
-def get_providedservice(service_id: int, db: Session = Depends(get_db)):
-    service = db.query(Providedservices).filter(Providedservices.id == service_id).first()
-    if service is None:
-        raise HTTPException(status_code=404, detail="Provided Service not found")
-    return service
-
-@app.post("/providedservices/", response_model=ProvidedService)
-def create_providedservice(service: ProvidedServiceCreate, db: Session = Depends(get_db)):
-    # Retrieve the latest providedservice ID and add 1
-    latest_service_id = db.query(func.max(Providedservices.id)).scalar() or 0
-    new_service = Providedservices(id=latest_service_id + 1, **service.dict())
-    db.add(new_service)
-    db.commit()
-    db.refresh(new_service)
-    return new_service
-
-@app.put("/providedservices/{service_id}", response_model=ProvidedService)
-def update_providedservice(service_id: int, service: ProvidedServiceCreate, db: Session = Depends(get_db)):
-    db_service = db.query(Providedservices).filter(Providedservices.id == service_id).first()
-    if db_service is None:
-        raise HTTPException(status_code=404, detail="Provided Service not found")
-    for key, value in service.dict().items():
-        setattr(db_service, key, value)
-    db.commit()
-    db.refresh(db_service)
-    return db_service
-
-@app.delete("/providedservices/{service_id}", response_model=dict)
-def delete_providedservice(service_id: int, db: Session = Depends(get_db)):
-    db_service = db.query(Providedservices).filter(Providedservices.id == service_id).first()
-    if db_service is None:
-        raise HTTPException(status_code=404, detail="Provided Service not found")
-    db.delete(db_service)
-    db.commit()
-    return {"message": "Provided Service deleted successfully"}
-
-# --- Repairparts CRUD Endpoints ---
-@app.get("/repairparts/", response_model=list[RepairPart])
-def get_all_repairparts(db: Session = Depends(get_db)):
-    return db.query(Repairparts).all()
-
-@app.get("/repairparts/{id}", response_model=RepairPart)
-def get_repairpart_by_id(id: int, db: Session = Depends(get_db)):
-    repairpart = db.query(Repairparts).filter(Repairparts.id == id).first()
-    if not repairpart:
-        raise HTTPException(status_code=404, detail="Repair part not found")
-    return repairpart
-
-@app.put("/repairparts/{id}", response_model=RepairPart)
-def update_repairpart(id: int, repairpart: RepairPartCreate, db: Session = Depends(get_db)):
-    db_repairpart = db.query(Repairparts).filter(Repairparts.id == id).first()
-    if not db_repairpart:
-        raise HTTPException(status_code=404, detail="Repair part not found")
-    for key, value in repairpart.dict().items():
-        setattr(db_repairpart, key, value)
-    db.commit()
-    db.refresh(db_repairpart)
-    return db_repairpart
-
-@app.delete("/repairparts/{id}", response_model=dict)
-def delete_repairpart(id: int, db: Session = Depends(get_db)):
-    db_repairpart = db.query(Repairparts).filter(Repairparts.id == id).first()
-    if not db_repairpart:
-        raise HTTPException(status_code=404, detail="Repair part not found")
-    db.delete(db_repairpart)
-    db.commit()
-    return {"detail": "Repair part deleted"}
-
-@app.post("/repairparts/", response_model=RepairPart)
-def create_repairpart(repairpart: RepairPartCreate, db: Session = Depends(get_db)):
-    latest_id = db.query(func.max(Repairparts.id)).scalar() or 0
-    new_repairpart = Repairparts(id=latest_id + 1, **repairpart.dict())
-    db.add(new_repairpart)
-    db.commit()
-    db.refresh(new_repairpart)
-    return new_repairpart
-
-# --- Responsibles CRUD Endpoints ---
-@app.get("/responsibles/", response_model=list[Responsible])
-def get_all_responsibles(db: Session = Depends(get_db)):
-    return db.query(Responsibles).all()
-
-@app.get("/responsibles/{id}", response_model=Responsible)
-def get_responsible_by_id(id: int, db: Session = Depends(get_db)):
-    responsible = db.query(Responsibles).filter(Responsibles.id == id).first()
-    if not responsible:
-        raise HTTPException(status_code=404, detail="Responsible not found")
-    return responsible
-
-@app.put("/responsibles/{id}", response_model=Responsible)
-def update_responsible(id: int, responsible: ResponsibleCreate, db: Session = Depends(get_db)):
-    db_responsible = db.query(Responsibles).filter(Responsibles.id == id).first()
-    if not db_responsible:
-        raise HTTPException(status_code=404, detail="Responsible not found")
-    for key, value in responsible.dict().items():
-        setattr(db_responsible, key, value)
-    db.commit()
-    db.refresh(db_responsible)
-    return db_responsible
-
-@app.delete("/responsibles/{id}", response_model=dict)
-def delete_responsible(id: int, db: Session = Depends(get_db)):
-    db_responsible = db.query(Responsibles).filter(Responsibles.id == id).first()
-    if not db_responsible:
-        raise HTTPException(status_code=404, detail="Responsible not found")
-    db.delete(db_responsible)
-    db.commit()
-    return {"detail": "Responsible deleted"}
-
-@app.post("/responsibles/", response_model=Responsible)
-def create_responsible(responsible: ResponsibleCreate, db: Session = Depends(get_db)):
-    latest_id = db.query(func.max(Responsibles.id)).scalar() or 0
-    new_responsible = Responsibles(id=latest_id + 1, **responsible.dict())
-    db.add(new_responsible)
-    db.commit()
-    db.refresh(new_responsible)
-    return new_responsible
-
-# --- Vehicles CRUD Endpoints ---
-@app.get("/vehicles/", response_model=list[Vehicle])
-def get_all_vehicles(db: Session = Depends(get_db)):
-    return db.query(Vehicles).all()
-
-@app.get("/vehicles/{id}", response_model=Vehicle)
-def get_vehicle_by_id(id: int, db: Session = Depends(get_db)):
-    vehicle = db.query(Vehicles).filter(Vehicles.id == id).first()
-    if not vehicle:
-        raise HTTPException(status_code=404, detail="Vehicle not found")
-    return vehicle
-
-@app.put("/vehicles/{id}", response_model=Vehicle)
-def update_vehicle(id: int, vehicle: VehicleCreate, db: Session = Depends(get_db)):
-    db_vehicle = db.query(Vehicles).filter(Vehicles.id == id).first()
-    if not db_vehicle:
-        raise HTTPException(status_code=404, detail="Vehicle not found")
-    for key, value in vehicle.dict().items():
-        setattr(db_vehicle, key, value)
-    db.commit()
-    db.refresh(db_vehicle)
-    return db_vehicle
-
-@app.delete("/vehicles/{id}", response_model=dict)
-def delete_vehicle(id: int, db: Session = Depends(get_db)):
-    db_vehicle = db.query(Vehicles).filter(Vehicles.id == id).first()
-    if not db_vehicle:
-        raise HTTPException(status_code=404, detail="Vehicle not found")
-    db.delete(db_vehicle)
-    db.commit()
-    return {"detail": "Vehicle deleted"}
-
-@app.post("/vehicles/", response_model=Vehicle)
-def create_vehicle(vehicle: VehicleCreate, db: Session = Depends(get_db)):
-    latest_id = db.query(func.max(Vehicles.id)).scalar() or 0
-    new_vehicle = Vehicles(id=latest_id + 1, **vehicle.dict())
-    db.add(new_vehicle)
-    db.commit()
-    db.refresh(new_vehicle)
-    return new_vehicle
-
-# --- Warrantiescards CRUD Endpoints ---
-@app.get("/warrantiescards/", response_model=list[WarrantyCard])
-def get_all_warrantiescards(db: Session = Depends(get_db)):
-    return db.query(Warrantiescards).all()
-
-@app.get("/warrantiescards/{id}", response_model=WarrantyCard)
-def get_warrantiescard_by_id(id: int, db: Session = Depends(get_db)):
-    warranty = db.query(Warrantiescards).filter(Warrantiescards.id == id).first()
-    if not warranty:
-        raise HTTPException(status_code=404, detail="Warranty card not found")
-    return warranty
-
-@app.put("/warrantiescards/{id}", response_model=WarrantyCard)
-def update_warrantiescard(id: int, warranty: WarrantyCardCreate, db: Session = Depends(get_db)):
-    db_warranty = db.query(Warrantiescards).filter(Warrantiescards.id == id).first()
-    if not db_warranty:
-        raise HTTPException(status_code=404, detail="Warranty card not found")
-    for key, value in warranty.dict().items():
-        setattr(db_warranty, key, value)
-    db.commit()
-    db.refresh(db_warranty)
-    return db_warranty
-
-@app.delete("/warrantiescards/{id}", response_model=dict)
-def delete_warrantiescard(id: int, db: Session = Depends(get_db)):
-    db_warranty = db.query(Warrantiescards).filter(Warrantiescards.id == id).first()
-    if not db_warranty:
-        raise HTTPException(status_code=404, detail="Warranty card not found")
-    db.delete(db_warranty)
-    db.commit()
-    return {"detail": "Warranty card deleted"}
-
-@app.post("/warrantiescards/", response_model=WarrantyCard)
-def create_warrantiescard(warranty: WarrantyCardCreate, db: Session = Depends(get_db)):
-    latest_id = db.query(func.max(Warrantiescards.id)).scalar() or 0
-    new_warranty = Warrantiescards(id=latest_id + 1, **warranty.dict())
-    db.add(new_warranty)
-    db.commit()
-    db.refresh(new_warranty)
-    return new_warranty
-
-# --- Repairsessions CRUD Endpoints ---
-@app.get("/repairsessions/", response_model=list[RepairSession])
-def get_all_repairsessions(db: Session = Depends(get_db)):
-    return db.query(Repairsessions).all()
-
-@app.get("/repairsessions/{id}", response_model=RepairSession)
-def get_repairsession_by_id(id: int, db: Session = Depends(get_db)):
-    session = db.query(Repairsessions).filter(Repairsessions.id == id).first()
-    if not session:
-        raise HTTPException(status_code=404, detail="Repair session not found")
-    return session
-
-@app.put("/repairsessions/{id}", response_model=RepairSession)
-def update_repairsession(id: int, session: RepairSessionCreate, db: Session = Depends(get_db)):
-    db_session = db.query(Repairsessions).filter(Repairsessions.id == id).first()
-    if not db_session:
-        raise HTTPException(status_code=404, detail="Repair session not found")
-    for key, value in session.dict().items():
-        setattr(db_session, key, value)
-    db.commit()
-    db.refresh(db_session)
-    return db_session
-
-@app.delete("/repairsessions/{id}", response_model=dict)
-def delete_repairsession(id: int, db: Session = Depends(get_db)):
-    db_session = db.query(Repairsessions).filter(Repairsessions.id == id).first()
-    if not db_session:
-        raise HTTPException(status_code=404, detail="Repair session not found")
-    db.delete(db_session)
-    db.commit()
-    return {"detail": "Repair session deleted"}
 
-@app.post("/repairsessions/", response_model=RepairSession)
-def create_repairsession(session: RepairSessionCreate, db: Session = Depends(get_db)):
-    latest_id = db.query(func.max(Repairsessions.id)).scalar() or 0
-    new_session = Repairsessions(id=latest_id + 1, **session.dict())
-    db.add(new_session)
-    db.commit()
-    db.refresh(new_session)
-    return new_session
\ No newline at end of file
+# (path prefix, model, read schema, create schema, label) for every resource
+RESOURCES = [
+    ("/clients/", Clients, Client, ClientCreate, "Client"),
+    ("/masters/", Masters, Master, MasterCreate, "Master"),
+    ("/providedservices/", Providedservices, ProvidedService, ProvidedServiceCreate, "Provided Service"),
+    ("/repairparts/", Repairparts, RepairPart, RepairPartCreate, "Repair part"),
+    ("/responsibles/", Responsibles, Responsible, ResponsibleCreate, "Responsible"),
+    ("/vehicles/", Vehicles, Vehicle, VehicleCreate, "Vehicle"),
+    ("/warrantiescards/", Warrantiescards, WarrantyCard, WarrantyCardCreate, "Warranty card"),
+    ("/repairsessions/", Repairsessions, RepairSession, RepairSessionCreate, "Repair session"),
+]
+
+# Conditional GET: list ETags come from the per-table cache generation that
+# every write handler bumps, single items are hashed
+app.add_middleware(ETagMiddleware)
+for prefix, *_ in RESOURCES:
+    register_collection(prefix, prefix.strip("/"))
+
+# GETs read from a healthy replica (DB_REPLICA_URLS); outside ETagMiddleware so
+# it knows where the body comes from
+app.add_middleware(ReplicaRoutingMiddleware, replicas=replicas)
+
+# Retried POSTs with the same Idempotency-Key get the first response instead of a second write
+app.add_middleware(IdempotencyMiddleware)
+
+# Per-client token buckets and in-flight caps; excess requests get a 429
+# before anything is read or queued for a connection
+app.add_middleware(RateLimitMiddleware)
+
+# Per-route latency, queries and DB time; added last so it wraps everything
+app.add_middleware(MetricsMiddleware)
+
+# --- Health Checks ---
+app.include_router(health_router(engine))
+
+# --- Connection Pool Gauges ---
+@app.get("/metrics/pool", response_model=dict)
+def get_pool_metrics():
+    stats = {"sync": pool_stats(engine.pool)}
+    if async_engine is not None:
+        stats["async"] = pool_stats(async_engine.pool)
+    if replicas:
+        stats["replicas"] = {
+            url: {"healthy": healthy, **pool_stats(replica.pool)}
+            for (url, healthy), replica in zip(replicas.stats().items(), replicas.engines)
+        }
+    return stats
+
+# --- Prometheus Metrics ---
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    pools = {"sync": engine.pool}
+    if async_engine is not None:
+        pools["async"] = async_engine.pool
+    for index, replica in enumerate(replicas.engines):
+        pools[f"replica{index}"] = replica.pool
+    return PlainTextResponse(render_metrics(pools), media_type="text/plain; version=0.0.4")
+
+# --- Change Feed (SSE / WebSocket) ---
+app.include_router(events_router([prefix.strip("/") for prefix, *_ in RESOURCES]))
+
+# --- Master Scheduling ---
+# Every write of a repair session is checked against the master's other bookings
+register_row_check(Repairsessions, check_bookings)
+# Deleting a session deletes its parts and services links
+register_linked_rows(
+    Repairsessions, RepairsessionsRepairparts.repair_session_id, RepairsessionsProvidedservices.repair_session_id
+)
+app.include_router(scheduling_router(get_db))
+
+# --- Warranty Lookup / Expiry ---
+app.include_router(warranty_router(get_db))
+
+# --- Search ---
+app.include_router(search_router(get_db))
+
+# --- Reports ---
+app.include_router(reports_router(get_db))
+
+# --- Repair Session Work Orders ---
+# Fixed paths under /repairsessions/, registered before the {id} routes
+app.include_router(workorder_router(get_db))
+
+# --- CRUD Endpoints ---
+# DB_ASYNC swaps the threadpool handlers for their AsyncSession counterparts;
+# /bulk, /import and /export endpoints are sync in both modes
+for prefix, model, schema, create_schema, label in RESOURCES:
+    if DB_ASYNC:
+        router = APIRouter()
+        add_bulk_routes(router, prefix, model, schema, create_schema, get_db)
+        add_transfer_routes(router, prefix, model, schema, create_schema, get_db)
+        app.include_router(router)
+        app.include_router(async_crud_router(prefix, model, schema, create_schema, label, get_async_db))
+    else:
+        app.include_router(crud_router(prefix, model, schema, create_schema, label, get_db))
+
+# Import finished; the lifespan adds the startup time
+readiness.imported()
@@ -0,0 +1,103 @@
+import argparse
+import sys
+from datetime import timedelta
+from models import SessionLocal, create_indexes, engine, sync_id_sequences
+from partitions import (
+    ARCHIVE_AFTER_YEARS, ARCHIVE_DIR, PARTITION_MONTHS_AHEAD,
+    archive_repairsessions, ensure_partitions, partition_repairsessions,
+)
+from reports import refresh_revenue_daily
+from scheduling import add_booking_constraint
+from schemas import utcnow
+from search import create_search_indexes
+from warranties import expiring_ids
+
+
+# Maintenance commands: python manage.py <command>
+def main():
+    parser = argparse.ArgumentParser(description="Auto service station database maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("sync-sequences", help="Create id sequences and move them past max(id)")
+    commands.add_parser("create-indexes", help="Build missing indexes without locking writes")
+    commands.add_parser("create-search-indexes", help="Build the Postgres trigram / full-text indexes behind /search")
+    commands.add_parser("add-booking-constraint", help="Make Postgres reject overlapping sessions of a master")
+    partition = commands.add_parser("partition-sessions", help="Convert repairsessions to monthly partitions (exclusive lock, Postgres)")
+    partition.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    partitions = commands.add_parser("create-partitions", help="Create the coming months' repairsessions partitions")
+    partitions.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    archive = commands.add_parser("archive-sessions", help="Move old finished sessions to gzipped NDJSON files or archive tables")
+    archive.add_argument("--years", type=int, default=ARCHIVE_AFTER_YEARS, help="Archive sessions that started more than this many years ago")
+    archive.add_argument("--to", choices=["file", "cold"], default="file", help="file: --dir/repairsessions-YYYY-MM.ndjson.gz; cold: *_archive tables")
+    archive.add_argument("--dir", default=ARCHIVE_DIR)
+    refresh = commands.add_parser("refresh-reports", help="Recompute the revenue_daily summary table")
+    refresh.add_argument("--days", type=int, default=7, help="Window to recompute; 0 rebuilds all history (older days keep their last figures)")
+    expiring = commands.add_parser("expiring-warranties", help="Print ids of warranty cards ending within --days")
+    expiring.add_argument("--days", type=int, default=30)
+    export = commands.add_parser("export", help="Stream a table to CSV / NDJSON")
+    export.add_argument("table")
+    export.add_argument("--output", help="File to write; stdout by default")
+    export.add_argument("--format", choices=["csv", "ndjson"], help="Defaults to the output file's extension, else ndjson")
+    load = commands.add_parser("import", help="Load a CSV / NDJSON file into a table in one transaction")
+    load.add_argument("table")
+    load.add_argument("path")
+    load.add_argument("--format", choices=["csv", "ndjson"], help="Defaults to the file's extension")
+    args = parser.parse_args()
+
+    if args.command == "sync-sequences":
+        sync_id_sequences(engine)
+    elif args.command == "create-indexes":
+        create_indexes(engine)
+    elif args.command == "create-search-indexes":
+        create_search_indexes(engine)
+    elif args.command == "add-booking-constraint":
+        add_booking_constraint(engine)
+    elif args.command == "partition-sessions":
+        partition_repairsessions(engine, args.months_ahead)
+    elif args.command == "create-partitions":
+        for name in ensure_partitions(engine, args.months_ahead):
+            print(name)
+    elif args.command == "archive-sessions":
+        for month, count in archive_repairsessions(engine, args.years, args.to, args.dir).items():
+            print(f"{month:%Y-%m}: {count}")
+    elif args.command == "refresh-reports":
+        with SessionLocal() as db:
+            refresh_revenue_daily(db, args.days or None)
+    elif args.command == "expiring-warranties":
+        now = utcnow()
+        with SessionLocal() as db:
+            for ids in expiring_ids(db, now, now + timedelta(days=args.days)):
+                print("\n".join(map(str, ids)))
+    elif args.command in ("export", "import"):
+        transfer(parser, args)
+
+
+def transfer(parser, args):
+    from fastapi import HTTPException
+    from main import RESOURCES
+    from transfer import export_rows, import_rows
+
+    resources = {prefix.strip("/"): (model, schema, create_schema) for prefix, model, schema, create_schema, _ in RESOURCES}
+    if args.table not in resources:
+        parser.error(f"unknown table {args.table}, expected one of: {', '.join(resources)}")
+    model, schema, create_schema = resources[args.table]
+    path = args.output if args.command == "export" else args.path
+    fmt = args.format or ("csv" if path and path.endswith(".csv") else "ndjson")
+    if args.command == "export":
+        output = open(path, "wb") if path else sys.stdout.buffer
+        try:
+            for chunk in export_rows(model, schema, fmt):
+                output.write(chunk)
+        finally:
+            if path:
+                output.close()
+        return
+    with open(path, encoding="utf-8", newline="") as stream, SessionLocal() as db:
+        try:
+            count = import_rows(db, model, create_schema, stream, fmt)
+        except HTTPException as e:
+            parser.exit(1, f"Import failed, nothing was written: {e.detail}\n")
+    print(f"Imported {count} rows into {args.table}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+from sqlalchemy import event
+from db_pool import pool_stats
+
+logger = logging.getLogger(__name__)
+
+# Statements slower than this are logged with their text
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    # Minimal Prometheus histogram keyed by a tuple of label values
+    def __init__(self, name, help, label_names, buckets):
+        self.name, self.help, self.label_names, self.buckets = name, help, label_names, buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def totals(self):
+        # (sum, count) over all label sets
+        with self._lock:
+            return sum(series[1] for series in self._series.values()), sum(series[2] for series in self._series.values())
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (buckets, total, count) in sorted(self._series.items()):
+                base = _labels(zip(self.label_names, labels))
+                for bound, bucket_count in zip(self.buckets, buckets):
+                    lines.append(f"{self.name}_bucket{{{base},le=\"{bound}\"}} {bucket_count}")
+                lines.append(f"{self.name}_bucket{{{base},le=\"+Inf\"}} {count}")
+                lines.append(f"{self.name}_sum{{{base}}} {total}")
+                lines.append(f"{self.name}_count{{{base}}} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name, self.help, self.value = name, help, 0
+        self._lock = threading.Lock()
+
+    def inc(self):
+        with self._lock:
+            self.value += 1
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter", f"{self.name} {self.value}"]
+
+
+def _labels(pairs):
+    escape = lambda value: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{key}="{escape(value)}"' for key, value in pairs)
+
+
+ROUTE_LABELS = ("method", "route", "status")
+request_latency = Histogram("http_request_duration_seconds", "Request latency by route", ROUTE_LABELS, LATENCY_BUCKETS)
+request_queries = Histogram("http_request_db_queries", "SQL statements issued per request", ROUTE_LABELS, QUERY_COUNT_BUCKETS)
+request_db_time = Histogram("http_request_db_seconds", "Time spent in the database per request", ROUTE_LABELS, LATENCY_BUCKETS)
+slow_queries = Counter("db_slow_queries_total", f"Statements slower than {SLOW_QUERY_MS:g} ms")
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+# Stats of the request being handled. Sync handlers run in the threadpool with
+# a copy of the context, which still points at the same RequestStats object.
+current_request = ContextVar("current_request", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = current_request.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_queries.inc()
+        logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, " ".join(statement.split())[:2000])
+
+
+def instrument_engine(engine):
+    # Count and time every statement; pass async_engine.sync_engine for an AsyncEngine
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+class MetricsMiddleware:
+    # Records latency, query count and DB time per route template (e.g. /clients/{id})
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = current_request.set(stats)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            current_request.reset(token)
+            route = scope.get("route")
+            labels = (scope["method"], route.path if route is not None else "unmatched", str(status))
+            request_latency.observe(labels, time.perf_counter() - start)
+            request_queries.observe(labels, stats.queries)
+            request_db_time.observe(labels, stats.db_seconds)
+
+
+def render(pools):
+    # Prometheus text exposition; pools maps a label to a connection pool
+    lines = []
+    for metric in (request_latency, request_queries, request_db_time, slow_queries):
+        lines.extend(metric.render())
+    gauges = {}
+    for pool_name, pool in pools.items():
+        for key, value in pool_stats(pool).items():
+            gauges.setdefault(f"db_pool_{key}", []).append((pool_name, value))
+    for name, values in sorted(gauges.items()):
+        kind = "counter" if name.endswith(("_count", "_seconds")) and "max" not in name else "gauge"
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f"{name}{{{_labels([('pool', pool_name)])}}} {value}" for pool_name, value in values)
+    return "\n".join(lines) + "\n"
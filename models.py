@@ -1,50 +1,110 @@
 import os
 
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+
+# Before the imports below: db_pool, metrics and replicas read their settings
+# from the environment when they are imported
+load_dotenv()
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.schema import CreateIndex
 from sqlalchemy.dialects.postgresql import ENUM
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, declarative_base, sessionmaker
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
-
-load_dotenv()
+from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime, ForeignKey, Index, Sequence
+from db_pool import engine_options
+from metrics import instrument_engine
+from replicas import DB_REPLICA_URLS, ReplicaSet, routing_session_class
 
-DATABASE_URL = f"postgresql://"+\
+# DATABASE_URL overrides the individual settings, e.g. to point at PgBouncer
+DATABASE_URL = os.getenv('DATABASE_URL') or f"postgresql://"+\
                 f"{os.getenv('DB_USER')}:"+\
                 f"{os.getenv('DB_PASSWORD')}@"+\
                 f"{os.getenv('DB_HOST')}:"+\
                 f"{os.getenv('DB_PORT')}/"+\
                 f"{os.getenv('DB_NAME')}"
 
+# Serve the CRUD endpoints from an asyncpg-backed AsyncSession instead of the threadpool
+DB_ASYNC = os.getenv('DB_ASYNC', '').lower() in ('1', 'true', 'yes')
+ASYNC_DATABASE_URL = DATABASE_URL.replace('postgresql://', 'postgresql+asyncpg://', 1)
+
 # Initialize SQLAlchemy Base and engine
 Base = declarative_base()
-engine = create_engine(DATABASE_URL)
+engine = create_engine(DATABASE_URL, **engine_options())
+# Per-request query count / DB time and slow-query log (see metrics.py)
+instrument_engine(engine)
+
+# Read replicas (DB_REPLICA_URLS); sessions opened for GET requests read from
+# one of them, see replicas.py
+replicas = ReplicaSet([create_engine(url, **engine_options()) for url in DB_REPLICA_URLS])
+for replica in replicas.engines:
+    instrument_engine(replica)
 
 # Create a session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+SessionLocal = sessionmaker(class_=routing_session_class(replicas), autocommit=False, autoflush=False, bind=engine)
+
+# Async engine and session factory, only built when enabled so asyncpg stays optional.
+# Objects are not expired on commit: there is no lazy refresh on an AsyncSession.
+async_engine = None
+AsyncSessionLocal = None
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(is_async=True))
+    instrument_engine(async_engine.sync_engine)
+    replicas.async_engines = [
+        create_async_engine(url.replace('postgresql://', 'postgresql+asyncpg://', 1), **engine_options(is_async=True))
+        for url in DB_REPLICA_URLS
+    ]
+    for replica in replicas.async_engines:
+        instrument_engine(replica.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine, sync_session_class=routing_session_class(replicas, is_async=True),
+        autoflush=False, expire_on_commit=False,
+    )
+
+# Ids handed out per connection on each sequence round trip (Postgres CACHE);
+# values above 1 let every worker draw ids from its own reserved block
+ID_SEQUENCE_CACHE = int(os.getenv('DB_ID_SEQUENCE_CACHE', '1'))
+
+
+def id_column(table_name):
+    # Primary key drawn from a per-table sequence: the INSERT calls nextval()
+    # inline and returns the id, so no max(id) lookup and no races between workers
+    return Column(Integer, Sequence(f'{table_name}_id_seq', cache=ID_SEQUENCE_CACHE), primary_key=True)
+
 
 # Define ENUM for Providedservices difficulty levels
 difficulty_enum = ENUM('легко', 'середнє', 'складно', name='difficulty_enum', create_type=False)
 
 
 # Models
+# Indexes backing the list filters (filters.py). Prefix searches use
+# text_pattern_ops so LIKE 'abc%' is an index range scan under any collation.
+def prefix_index(name, column):
+    return Index(name, column, postgresql_ops={column: 'text_pattern_ops'})
+
+
 class Clients(Base):
     __tablename__ = 'clients'
-    id = Column(Integer, primary_key=True)
+    __table_args__ = (
+        prefix_index('ix_clients_name', 'name'),
+        prefix_index('ix_clients_telephone', 'telephone'),
+    )
+    id = id_column('clients')
     name = Column(String(50), nullable=False)
     telephone = Column(String(50), nullable=False)
 
 
 class Masters(Base):
     __tablename__ = 'masters'
-    id = Column(Integer, primary_key=True)
+    id = id_column('masters')
     name = Column(String(50), nullable=False)
     telephone = Column(String(50), nullable=False)
 
 
 class Providedservices(Base):
     __tablename__ = 'providedservices'
-    id = Column(Integer, primary_key=True)
+    id = id_column('providedservices')
     name = Column(String(50), nullable=False)
     category = Column(String(50), nullable=False)
     difficulty = Column(difficulty_enum, nullable=False)
@@ -52,7 +112,7 @@ class Providedservices(Base):
 
 class Repairparts(Base):
     __tablename__ = 'repairparts'
-    id = Column(Integer, primary_key=True)
+    id = id_column('repairparts')
     name = Column(String(50), nullable=False)
     amount_on_station = Column(Integer, nullable=False)
     amount_on_storage = Column(Integer, nullable=False)
@@ -60,14 +120,17 @@ class Repairparts(Base):
 
 class Responsibles(Base):
     __tablename__ = 'responsibles'
-    id = Column(Integer, primary_key=True)
+    id = id_column('responsibles')
     name = Column(String(50), nullable=False)
     telephone = Column(String(50), nullable=False)
 
 
 class Vehicles(Base):
     __tablename__ = 'vehicles'
-    id = Column(Integer, primary_key=True)
+    __table_args__ = (
+        Index('ix_vehicles_client_id', 'client_id'),
+    )
+    id = id_column('vehicles')
     brand = Column(String(50), nullable=False)
     model = Column(String(50), nullable=False)
     manufacture_year = Column(Integer, nullable=False)
@@ -78,7 +141,13 @@ class Vehicles(Base):
 
 class Warrantiescards(Base):
     __tablename__ = 'warrantiescards'
-    id = Column(Integer, primary_key=True)
+    __table_args__ = (
+        # Warranty lookup: cards of a vehicle (for a service) still valid at a date.
+        # Also serves vehicle_id alone, so it replaces ix_warrantiescards_vehicle_id.
+        Index('ix_warrantiescards_vehicle_id_service_id_end_date', 'vehicle_id', 'provided_service_id', 'end_date'),
+        Index('ix_warrantiescards_end_date', 'end_date'),
+    )
+    id = id_column('warrantiescards')
     start_date = Column(DateTime, nullable=False)
     end_date = Column(DateTime, nullable=False)
     vehicle_id = Column(Integer, ForeignKey('vehicles.id'), nullable=False)
@@ -90,7 +159,19 @@ class Warrantiescards(Base):
 
 class Repairsessions(Base):
     __tablename__ = 'repairsessions'
-    id = Column(Integer, primary_key=True)
+    __table_args__ = (
+        # "open sessions of a master", paginated by id
+        Index('ix_repairsessions_master_id_if_finished', 'master_id', 'if_finished', 'id'),
+        Index('ix_repairsessions_master_id_date_start', 'master_id', 'date_start'),
+        # Booking overlap checks / availability: sessions of a master ending after a point in time
+        Index('ix_repairsessions_master_id_date_end', 'master_id', 'date_end'),
+        Index('ix_repairsessions_vehicle_id', 'vehicle_id'),
+        Index('ix_repairsessions_responsible_id', 'responsible_id'),
+        Index('ix_repairsessions_date_start', 'date_start'),
+        Index('ix_repairsessions_date_end', 'date_end'),
+        prefix_index('ix_repairsessions_order_number', 'order_number'),
+    )
+    id = id_column('repairsessions')
     order_number = Column(String(50), nullable=False)
     date_start = Column(DateTime, nullable=False)
     date_end = Column(DateTime, nullable=False)
@@ -108,6 +189,8 @@ class Repairsessions(Base):
     master = relationship("Masters")
     repair_parts = relationship("Repairparts", secondary="repairsessions_repairparts")
     provided_services = relationship("Providedservices", secondary="repairsessions_providedservices")
+    # Link rows, for reading the used amount of each part alongside the part
+    part_links = relationship("RepairsessionsRepairparts", viewonly=True)
 
 
 class RepairsessionsRepairparts(Base):
@@ -116,8 +199,112 @@ class RepairsessionsRepairparts(Base):
     repair_part_id = Column(Integer, ForeignKey('repairparts.id'), primary_key=True)
     amount = Column(Integer, default=0)
 
+    repair_part = relationship("Repairparts", viewonly=True)
+
 
 class RepairsessionsProvidedservices(Base):
     __tablename__ = 'repairsessions_providedservices'
     repair_session_id = Column(Integer, ForeignKey('repairsessions.id'), primary_key=True)
     provided_service_id = Column(Integer, ForeignKey('providedservices.id'), primary_key=True)
+
+
+# Summary table for the revenue report, refreshed incrementally by
+# reports.refresh_revenue_daily (python manage.py refresh-reports)
+# Where background jobs that must resume after a restart stopped (see
+# warranties.sweep_expiring)
+class JobState(Base):
+    __tablename__ = 'job_state'
+    name = Column(String(50), primary_key=True)
+    done_until = Column(DateTime, nullable=False)
+
+
+class RevenueDaily(Base):
+    __tablename__ = 'revenue_daily'
+    day = Column(Date, primary_key=True)
+    sessions = Column(Integer, nullable=False)
+    total_sum = Column(Integer, nullable=False)
+    paid_sum = Column(Integer, nullable=False)
+    refreshed_at = Column(DateTime, nullable=False)
+
+
+def _id_sequence_state(conn, table, seq):
+    # (cache size, None when the sequence is missing; id column default)
+    cache = conn.scalar(text(
+        "SELECT cache_size FROM pg_sequences WHERE schemaname = current_schema() AND sequencename = :name"
+    ), {"name": seq.name})
+    default = conn.scalar(text(
+        "SELECT pg_get_expr(d.adbin, d.adrelid) FROM pg_attrdef d "
+        "JOIN pg_attribute a ON a.attrelid = d.adrelid AND a.attnum = d.adnum "
+        "WHERE d.adrelid = CAST(:table AS regclass) AND a.attname = 'id'"
+    ), {"table": table.name})
+    return cache, default
+
+
+def _id_sequences():
+    return [
+        (table, table.c.id.default) for table in Base.metadata.sorted_tables
+        if isinstance(getattr(table.c.get('id'), 'default', None), Sequence)
+    ]
+
+
+def missing_id_sequences(bind):
+    # Tables whose id sequence or column default isn't in place yet; a
+    # catalog read, so workers can check it on every start
+    if bind.dialect.name != 'postgresql':
+        return []
+    with bind.connect() as conn:
+        return [
+            table.name for table, seq in _id_sequences()
+            if _id_sequence_state(conn, table, seq) != (ID_SEQUENCE_CACHE, f"nextval('{seq.name}'::regclass)")
+        ]
+
+
+def sync_id_sequences(bind):
+    # Bring databases created before the id sequences existed up to date:
+    # create each sequence, make it the column default (for raw SQL and COPY)
+    # and move it past the current max(id). A sequence is never moved backwards,
+    # so ids already reserved by running workers stay valid. The DDL only runs
+    # where something differs: ALTER TABLE takes an ACCESS EXCLUSIVE lock, which
+    # waits for (and holds up everything behind) long reads of the table.
+    if bind.dialect.name != 'postgresql':
+        return
+    with bind.begin() as conn:
+        # Serialize concurrent runs
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('sync_id_sequences'))"))
+        for table, seq in _id_sequences():
+            cache, default = _id_sequence_state(conn, table, seq)
+            if cache is None:
+                conn.execute(text(
+                    f"CREATE SEQUENCE {seq.name} CACHE {ID_SEQUENCE_CACHE} OWNED BY {table.name}.id"
+                ))
+            elif cache != ID_SEQUENCE_CACHE:
+                conn.execute(text(f"ALTER SEQUENCE {seq.name} CACHE {ID_SEQUENCE_CACHE}"))
+            if default != f"nextval('{seq.name}'::regclass)":
+                conn.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN id SET DEFAULT nextval('{seq.name}')"))
+            conn.execute(text(
+                f"SELECT setval('{seq.name}', GREATEST("
+                f"(SELECT COALESCE(MAX(id), 0) FROM {table.name}), "
+                f"(SELECT CASE WHEN is_called THEN last_value ELSE last_value - 1 END FROM {seq.name})"
+                f") + 1, false)"
+            ))
+
+
+def partitioned_tables(conn):
+    # Names of the partitioned parent tables (Postgres; see partitions.py)
+    if conn.dialect.name != 'postgresql':
+        return set()
+    return set(conn.scalars(text("SELECT partrelid::regclass::text FROM pg_partitioned_table")))
+
+
+def create_indexes(bind):
+    # Build any missing model indexes on an existing database. CONCURRENTLY keeps
+    # the tables writable meanwhile, which needs autocommit (no transaction).
+    # Postgres can't build an index concurrently on a partitioned table.
+    with bind.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        partitioned = partitioned_tables(conn)
+        for table in Base.metadata.sorted_tables:
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=conn.dialect))
+                if conn.dialect.name == 'postgresql' and table.name not in partitioned:
+                    ddl = ddl.replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY', 1)
+                conn.execute(text(ddl))
@@ -0,0 +1,88 @@
+import orjson
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from filters import ListQuery, apply_list_query, encode_cursor
+from models import AsyncSessionLocal, SessionLocal
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Rows fetched per round trip from the server-side cursor when streaming
+STREAM_CHUNK_SIZE = 1000
+
+# List responses are read-only, so they skip the ORM and Pydantic entirely:
+# only the columns of the read schema are selected, rows come back as plain
+# tuples (no identity map) and orjson encodes them straight to bytes. This
+# relies on each read schema's fields being the table's columns.
+
+
+def _columns(model, schema):
+    return [model.__table__.c[name] for name in schema.model_fields]
+
+
+def _list_statement(model, schema, after_id, query=None):
+    # Keyset pagination on the primary key (or (sort column, id)): an index
+    # range scan, no OFFSET
+    return apply_list_query(select(*_columns(model, schema)), query or ListQuery(model), after_id)
+
+
+def _page_json(schema, rows, limit, query=None):
+    keys = list(schema.model_fields)
+    items = [dict(zip(keys, row)) for row in rows[:limit]]
+    # One extra row was fetched to know whether there is a next page
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        if query is None or query.sort_column is None:
+            next_cursor = last["id"]
+        else:
+            next_cursor = encode_cursor(last[query.sort_column.name], last["id"])
+    return orjson.dumps({"items": items, "next_cursor": next_cursor})
+
+
+def _ndjson(schema, rows):
+    keys = list(schema.model_fields)
+    return b"".join(orjson.dumps(dict(zip(keys, row)), option=orjson.OPT_APPEND_NEWLINE) for row in rows)
+
+
+def json_response(body):
+    return Response(body, media_type="application/json")
+
+
+def paginate(db, model, schema, after_id, limit, query=None):
+    # A Page[schema] as JSON bytes
+    rows = db.execute(_list_statement(model, schema, after_id, query).limit(limit + 1)).all()
+    return _page_json(schema, rows, limit, query)
+
+
+async def paginate_async(db, model, schema, after_id, limit, query=None):
+    rows = (await db.execute(_list_statement(model, schema, after_id, query).limit(limit + 1))).all()
+    return _page_json(schema, rows, limit, query)
+
+
+def ndjson_chunks(model, schema, after_id=None, query=None):
+    # The request session is closed before the body is sent, so the
+    # generator owns its own session for the lifetime of the stream
+    db = SessionLocal()
+    try:
+        stmt = _list_statement(model, schema, after_id, query).execution_options(yield_per=STREAM_CHUNK_SIZE)
+        for chunk in db.execute(stmt).partitions():
+            yield _ndjson(schema, chunk)
+    finally:
+        db.close()
+
+
+def stream_ndjson(model, schema, after_id=None, query=None):
+    return StreamingResponse(ndjson_chunks(model, schema, after_id, query), media_type="application/x-ndjson")
+
+
+def stream_ndjson_async(model, schema, after_id=None, query=None):
+    async def rows():
+        async with AsyncSessionLocal() as db:
+            stmt = _list_statement(model, schema, after_id, query).execution_options(yield_per=STREAM_CHUNK_SIZE)
+            result = await db.stream(stmt)
+            async for chunk in result.partitions():
+                yield _ndjson(schema, chunk)
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
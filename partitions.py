@@ -0,0 +1,326 @@
+import asyncio
+import gzip
+import logging
+import os
+import zlib
+from datetime import date
+import orjson
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import Column, DateTime, Integer, MetaData, Table, delete, func, insert, select, text
+from sqlalchemy.schema import AddConstraint
+from cache import cache
+from events import notify
+from models import Repairsessions, RepairsessionsProvidedservices, RepairsessionsRepairparts, engine, partitioned_tables
+from search import SEARCH_INDEXES
+
+logger = logging.getLogger(__name__)
+
+# Monthly partitions kept ready ahead of the current month
+PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', '3'))
+# Seconds between partition maintenance runs in the app; 0 disables the background job
+PARTITION_MAINTENANCE_INTERVAL = int(os.getenv('PARTITION_MAINTENANCE_INTERVAL', '86400'))
+# Finished sessions that started more than this many years ago are archived
+ARCHIVE_AFTER_YEARS = int(os.getenv('ARCHIVE_AFTER_YEARS', '3'))
+# Where "file" archives go, one gzipped NDJSON file per month
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+# Optional tablespace (e.g. on cheaper disks) for the "cold" archive tables (Postgres)
+ARCHIVE_TABLESPACE = os.getenv('ARCHIVE_TABLESPACE', '')
+
+# Sessions exported and deleted per statement while archiving
+ARCHIVE_BATCH_SIZE = 1000
+
+# Only one worker runs partition maintenance at a time
+MAINTENANCE_LOCK = zlib.crc32(b"repairsessions.partitions") & 0x7FFFFFFF
+
+TABLE = Repairsessions.__tablename__
+DEFAULT_PARTITION = f"{TABLE}_default"
+LINK_TABLES = (RepairsessionsRepairparts.__table__, RepairsessionsProvidedservices.__table__)
+
+# id -> date_start of every session, kept by a trigger once repairsessions is
+# partitioned. Its primary key keeps ids unique again, and it gives lookups by
+# id the date_start that lets Postgres scan one partition instead of probing
+# the id index of every month (see session_date_bound).
+ID_MAP = Table(
+    f"{TABLE}_ids", MetaData(),
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("date_start", DateTime, nullable=False),
+)
+ID_MAP_TRIGGER = f"{TABLE}_ids_sync"
+
+
+def _month(value):
+    return date(value.year, value.month, 1)
+
+
+def _next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"{TABLE}_y{month.year}m{month.month:02d}"
+
+
+def _partitions(conn):
+    return set(conn.scalars(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = CAST(:table AS regclass)"
+    ), {"table": TABLE}))
+
+
+def has_id_map(conn):
+    return conn.scalar(text("SELECT to_regclass(:name)"), {"name": ID_MAP.name}) is not None
+
+
+def _install_id_map(conn):
+    # A plain INSERT: a duplicate id fails the write, as the old primary key did
+    ID_MAP.create(conn)
+    conn.execute(text(f"INSERT INTO {ID_MAP.name} (id, date_start) SELECT id, date_start FROM {TABLE}"))
+    conn.execute(text(f"""
+        CREATE FUNCTION {ID_MAP_TRIGGER}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'UPDATE' AND NEW.id = OLD.id AND NEW.date_start = OLD.date_start THEN
+                RETURN NULL;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                DELETE FROM {ID_MAP.name} WHERE id = OLD.id;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'INSERT') THEN
+                INSERT INTO {ID_MAP.name} (id, date_start) VALUES (NEW.id, NEW.date_start);
+            END IF;
+            RETURN NULL;
+        END $$
+    """))
+    conn.execute(text(
+        f"CREATE TRIGGER {ID_MAP_TRIGGER} AFTER INSERT OR UPDATE OF id, date_start OR DELETE ON {TABLE} "
+        f"FOR EACH ROW EXECUTE FUNCTION {ID_MAP_TRIGGER}()"
+    ))
+
+
+def session_date_bound(session_id):
+    # Extra condition for statements on one session by id. As a scalar
+    # subquery it runs first, and run-time partition pruning (Postgres 14+ for
+    # UPDATE / DELETE) leaves only that session's month to scan. Registered by
+    # the app lifespan when repairsessions is partitioned.
+    return Repairsessions.date_start == select(ID_MAP.c.date_start).where(ID_MAP.c.id == session_id).scalar_subquery()
+
+
+def _create_partition(conn, month):
+    # The month's partition is built detached, gets the month's rows that had
+    # landed in the default partition, then is attached: attaching while those
+    # rows sat in the default partition would fail
+    name, end = partition_name(month), _next_month(month)
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    conn.execute(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE date_start >= :start AND date_start < :end RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ), {"start": month, "end": end})
+    conn.execute(text(f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM ('{month}') TO ('{end}')"))
+    # Deleting the moved rows from the default partition took their ids out of
+    # the id map, and the detached table had no trigger to put them back
+    if has_id_map(conn):
+        conn.execute(text(f"INSERT INTO {ID_MAP.name} (id, date_start) SELECT id, date_start FROM {name}"))
+
+
+def partition_repairsessions(bind, months_ahead=PARTITION_MONTHS_AHEAD):
+    # One-off conversion of repairsessions into a table range-partitioned by
+    # month of date_start, so queries bounded on date_start (reports, booking
+    # checks, availability) only scan the months they ask for, and archiving a
+    # month can drop its partition. Copies the whole table under an exclusive
+    # lock: run it in a maintenance window. Postgres requires the partition key
+    # in the primary key, which becomes (id, date_start); repairsessions_ids
+    # (ID_MAP) keeps ids unique and is what single-session reads and writes by
+    # id go through (session_date_bound). List pages ordered by id and bulk
+    # writes by ids still probe the id index of every partition: a merge of
+    # per-partition index scans, each stopping after the page's rows, so their
+    # cost grows with the number of months kept. Foreign keys can't point at a
+    # partitioned table: the link tables' foreign keys to repairsessions and
+    # the booking exclusion constraint are dropped; the API deletes a session's
+    # link rows with it (bulk.LINKED_ROWS) and keeps checking bookings. The
+    # /search full-text index is rebuilt if it existed. Run on a table
+    # partitioned before the id map existed, it only adds the map.
+    if bind.dialect.name != "postgresql":
+        raise RuntimeError("Partitioning needs Postgres")
+    table = Repairsessions.__table__
+    with bind.begin() as conn:
+        if TABLE in partitioned_tables(conn):
+            if not has_id_map(conn):
+                _install_id_map(conn)
+            return
+        # Indexes outside the model go with the old table
+        search_indexes = [
+            (name, expression) for table_name, name, expression in SEARCH_INDEXES
+            if table_name == TABLE and conn.scalar(text("SELECT to_regclass(:name)"), {"name": name}) is not None
+        ]
+        conn.execute(text(f"LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE"))
+        conn.execute(text(f"ALTER TABLE {TABLE} RENAME TO {TABLE}_unpartitioned"))
+        conn.execute(text(
+            f"CREATE TABLE {TABLE} (LIKE {TABLE}_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            "PARTITION BY RANGE (date_start)"
+        ))
+        conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT"))
+        oldest = conn.scalar(text(f"SELECT min(date_start) FROM {TABLE}_unpartitioned"))
+        month = _month(oldest or date.today())
+        last = _add_months(_month(date.today()), months_ahead)
+        while month <= last:
+            _create_partition(conn, month)
+            month = _next_month(month)
+        conn.execute(text(f"INSERT INTO {TABLE} SELECT * FROM {TABLE}_unpartitioned"))
+        # The id sequence belongs to the old table's column and would go with it
+        sequence = table.c.id.default.name
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {TABLE}.id"))
+        conn.execute(text(f"DROP TABLE {TABLE}_unpartitioned CASCADE"))
+        conn.execute(text(f"ALTER TABLE {TABLE} ADD PRIMARY KEY (id, date_start)"))
+        for constraint in table.foreign_key_constraints:
+            conn.execute(AddConstraint(constraint))
+        for index in table.indexes:
+            index.create(conn)
+        for name, expression in search_indexes:
+            conn.execute(text(f"CREATE INDEX {name} ON {TABLE} USING gin ({expression})"))
+        _install_id_map(conn)
+
+
+def ensure_partitions(bind, months_ahead=PARTITION_MONTHS_AHEAD):
+    # Creates the partitions of the coming months, and of any month whose rows
+    # ended up in the default partition. Returns the names created. No-op
+    # unless repairsessions is partitioned.
+    if bind.dialect.name != "postgresql":
+        return []
+    created = []
+    with bind.begin() as conn:
+        if TABLE not in partitioned_tables(conn):
+            return []
+        if not conn.scalar(select(func.pg_try_advisory_xact_lock(MAINTENANCE_LOCK))):
+            return []
+        existing = _partitions(conn)
+        this_month = _month(date.today())
+        months = {_add_months(this_month, offset) for offset in range(months_ahead + 1)}
+        months.update(
+            _month(value) for value in conn.scalars(text(f"SELECT DISTINCT date_trunc('month', date_start) FROM {DEFAULT_PARTITION}"))
+        )
+        for month in sorted(months):
+            if partition_name(month) not in existing:
+                _create_partition(conn, month)
+                created.append(partition_name(month))
+    return created
+
+
+async def run_partition_maintenance():
+    # Background job started by the app lifespan
+    while True:
+        await asyncio.sleep(PARTITION_MAINTENANCE_INTERVAL)
+        try:
+            created = await run_in_threadpool(ensure_partitions, engine)
+            if created:
+                logger.info("Created partitions %s", ", ".join(created))
+        except Exception:
+            logger.exception("Partition maintenance failed")
+
+
+def _archive_table(table, metadata):
+    # Same columns and primary key, no foreign keys or defaults
+    return Table(
+        f"{table.name}_archive", metadata,
+        *(Column(column.name, column.type, primary_key=column.primary_key, autoincrement=False) for column in table.c),
+        postgresql_tablespace=ARCHIVE_TABLESPACE or None,
+    )
+
+
+def _write_rows(output, table, rows):
+    for row in rows:
+        output.write(orjson.dumps({"table": table.name, "row": row._asdict()}, option=orjson.OPT_APPEND_NEWLINE))
+
+
+def _archive_month(bind, month, target, directory, archive_tables):
+    # Moves the month's finished sessions and their link rows out, in one
+    # transaction. A file is written under a temporary name and only renamed
+    # once the rows are deleted, so a failed run leaves no half archive behind.
+    sessions = Repairsessions.__table__
+    where = (sessions.c.if_finished.is_(True), sessions.c.date_start >= month, sessions.c.date_start < _next_month(month))
+    # A later run for the same month (sessions finished since) adds a numbered file
+    path = os.path.join(directory, f"{TABLE}-{month:%Y-%m}.ndjson.gz")
+    run = 1
+    while os.path.exists(path):
+        run += 1
+        path = os.path.join(directory, f"{TABLE}-{month:%Y-%m}.{run}.ndjson.gz")
+    output = gzip.open(path + ".tmp", "wb") if target == "file" else None
+    batches = []
+    try:
+        with bind.begin() as conn:
+            while True:
+                ids = list(conn.scalars(
+                    select(sessions.c.id).where(*where).order_by(sessions.c.id).limit(ARCHIVE_BATCH_SIZE).with_for_update()
+                ))
+                if not ids:
+                    break
+                for table in (*LINK_TABLES, sessions):
+                    key = table.c.id if table is sessions else table.c.repair_session_id
+                    if output is not None:
+                        _write_rows(output, table, conn.execute(select(table).where(key.in_(ids))))
+                    else:
+                        conn.execute(insert(archive_tables[table.name]).from_select(
+                            [column.name for column in table.c], select(table).where(key.in_(ids))
+                        ))
+                    conn.execute(delete(table).where(key.in_(ids)))
+                notify(conn, TABLE, "archived", ids)
+                batches.append(ids)
+            # A month left with no sessions at all gives up its partition
+            name = partition_name(month)
+            if batches and name in (_partitions(conn) if conn.dialect.name == "postgresql" else ()):
+                if conn.scalar(text(f"SELECT NOT EXISTS (SELECT 1 FROM {name})")):
+                    conn.execute(text(f"DROP TABLE {name}"))
+            if output is not None:
+                output.close()
+        if output is not None:
+            if batches:
+                os.replace(path + ".tmp", path)
+            else:
+                os.remove(path + ".tmp")
+    except BaseException:
+        if output is not None:
+            output.close()
+            os.remove(path + ".tmp")
+        raise
+    return sum(len(ids) for ids in batches)
+
+
+def archive_repairsessions(bind, years=ARCHIVE_AFTER_YEARS, target="file", directory=ARCHIVE_DIR):
+    # Moves finished sessions that started more than <years> years ago (whole
+    # months) out of the hot tables, month by month: into gzipped NDJSON files
+    # under <directory> ("file") or into repairsessions_archive and the
+    # *_archive link tables ("cold", optionally in ARCHIVE_TABLESPACE).
+    # Unfinished sessions stay. Returns {month: sessions archived}.
+    # revenue_daily isn't touched: refresh the reports before archiving, and a
+    # later full rebuild (refresh-reports --days 0) only counts what is left.
+    # App workers hear of it through "archived" events with the postgres events
+    # backend and drop their list ETags with a shared cache (CACHE_URL); with
+    # the memory backends neither reaches them (list ETags are hashed then).
+    today = date.today()
+    cutoff = date(today.year - years, today.month, 1)
+    sessions = Repairsessions.__table__
+    with bind.connect() as conn:
+        oldest = conn.scalar(select(func.min(sessions.c.date_start)).where(sessions.c.if_finished.is_(True), sessions.c.date_start < cutoff))
+    if oldest is None:
+        return {}
+    archive_tables = {}
+    if target == "cold":
+        metadata = MetaData()
+        archive_tables = {table.name: _archive_table(table, metadata) for table in (sessions, *LINK_TABLES)}
+        metadata.create_all(bind)
+    else:
+        os.makedirs(directory, exist_ok=True)
+    archived = {}
+    month = _month(oldest)
+    while month < cutoff:
+        count = _archive_month(bind, month, target, directory, archive_tables)
+        if count:
+            archived[month] = count
+            logger.info("Archived %d sessions of %s", count, f"{month:%Y-%m}")
+        month = _next_month(month)
+    if archived:
+        cache.invalidate(TABLE)
+    return archived
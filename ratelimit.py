@@ -0,0 +1,199 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from cache import CACHE_URL, CACHED_NAMESPACES
+from etag import COLLECTION_PATHS
+
+
+# Per client (known API key, else IP) and route class: sustained requests per second,
+# burst size and requests running at once; 0 turns a limit off. The defaults
+# leave room for a whole office behind one NAT address loading its screens
+# and only stop clients that loop over the API.
+RATE_LIMIT_RPS = float(os.getenv('RATE_LIMIT_RPS', '50'))
+RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', '100'))
+RATE_LIMIT_IN_FLIGHT = int(os.getenv('RATE_LIMIT_IN_FLIGHT', '20'))
+# Heavy routes: list pages (GET) of the uncached tables, exports / imports,
+# bulk writes, reports and search
+RATE_LIMIT_HEAVY_RPS = float(os.getenv('RATE_LIMIT_HEAVY_RPS', '10'))
+RATE_LIMIT_HEAVY_BURST = int(os.getenv('RATE_LIMIT_HEAVY_BURST', '40'))
+RATE_LIMIT_HEAVY_IN_FLIGHT = int(os.getenv('RATE_LIMIT_HEAVY_IN_FLIGHT', '6'))
+# Behind a proxy: take the client IP from the first X-Forwarded-For entry
+RATE_LIMIT_TRUST_FORWARDED = os.getenv('RATE_LIMIT_TRUST_FORWARDED', 'false').lower() in ('1', 'true', 'yes')
+# Comma-separated API keys issued to integrations. Only these identify a client
+# on their own; any other X-API-Key is ignored, so rotating made-up keys can't
+# mint fresh buckets
+RATE_LIMIT_API_KEYS = {key.strip() for key in os.getenv('RATE_LIMIT_API_KEYS', '').split(',') if key.strip()}
+# Clients tracked by the memory backend; the least recently seen are dropped first
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv('RATE_LIMIT_MAX_CLIENTS', '10000'))
+
+# route class -> (rate, burst, in-flight cap)
+LIMITS = {
+    "light": (RATE_LIMIT_RPS, RATE_LIMIT_BURST, RATE_LIMIT_IN_FLIGHT),
+    "heavy": (RATE_LIMIT_HEAVY_RPS, RATE_LIMIT_HEAVY_BURST, RATE_LIMIT_HEAVY_IN_FLIGHT),
+}
+
+# Probes, metrics and the long-lived change feed are never limited
+EXEMPT_PATHS = {"/healthz", "/readyz", "/metrics", "/metrics/pool"}
+EXEMPT_PREFIXES = ("/events",)
+HEAVY_PREFIXES = ("/reports/", "/search")
+HEAVY_SUFFIXES = ("/export", "/import", "/bulk")
+
+# A worker that dies mid-request leaves its in-flight slot taken in Redis;
+# idle counters expire after this many seconds
+IN_FLIGHT_TTL = 300
+
+
+def route_class(scope):
+    # "light", "heavy" or None (not limited)
+    path = scope["path"]
+    if path in EXEMPT_PATHS or path.startswith(EXEMPT_PREFIXES):
+        return None
+    if path in COLLECTION_PATHS and scope["method"] in ("GET", "HEAD"):
+        # Reference tables are served from the cache
+        return "light" if COLLECTION_PATHS[path] in CACHED_NAMESPACES else "heavy"
+    if path.startswith(HEAVY_PREFIXES) or path.endswith(HEAVY_SUFFIXES):
+        return "heavy"
+    return "light"
+
+
+def client_key(scope):
+    # The X-API-Key of an integration if it is one of RATE_LIMIT_API_KEYS
+    # (hashed, so keys never reach the store), else the client IP
+    headers = Headers(scope=scope)
+    api_key = headers.get("x-api-key")
+    if api_key and api_key in RATE_LIMIT_API_KEYS:
+        return "key:" + hashlib.blake2b(api_key.encode(), digest_size=12).hexdigest()
+    forwarded = headers.get("x-forwarded-for") if RATE_LIMIT_TRUST_FORWARDED else None
+    if forwarded:
+        return "ip:" + forwarded.split(",")[0].strip()
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+class MemoryLimiter:
+    # Per-process token buckets and in-flight counters. With several workers
+    # each enforces the limits on its own, so a client gets up to
+    # workers x limit; use the shared backend (CACHE_URL) for one global limit.
+    # Async like RedisLimiter's methods, though nothing here waits.
+    def __init__(self, max_clients=RATE_LIMIT_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # key -> (tokens, updated at)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    async def take(self, key, rate, burst):
+        # Takes a token; returns 0 if there was one, else seconds until there is
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return wait
+
+    async def acquire(self, key, limit):
+        with self._lock:
+            if self._in_flight.get(key, 0) >= limit:
+                return False
+            self._in_flight[key] = self._in_flight.get(key, 0) + 1
+            return True
+
+    async def release(self, key):
+        with self._lock:
+            count = self._in_flight.pop(key, 1) - 1
+            if count > 0:
+                self._in_flight[key] = count
+
+
+# Token bucket in a hash (tokens, updated at), refilled from the Redis clock so
+# workers on different hosts agree
+_TAKE_SCRIPT = """
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+_ACQUIRE_SCRIPT = """
+local count = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+if count > tonumber(ARGV[1]) then
+    redis.call('DECR', KEYS[1])
+    return 0
+end
+return 1
+"""
+
+
+class RedisLimiter:
+    # Shared across workers and hosts: one limit per client for the whole
+    # deployment. The asyncio client, so the round trips don't block the loop.
+    def __init__(self, url):
+        import redis.asyncio
+        client = redis.asyncio.Redis.from_url(url)
+        self._client = client
+        self._take = client.register_script(_TAKE_SCRIPT)
+        self._acquire = client.register_script(_ACQUIRE_SCRIPT)
+
+    async def take(self, key, rate, burst):
+        return float(await self._take(keys=[key], args=[rate, burst]))
+
+    async def acquire(self, key, limit):
+        return bool(await self._acquire(keys=[key], args=[limit, IN_FLIGHT_TTL]))
+
+    async def release(self, key):
+        await self._client.decr(key)
+
+
+class RateLimitMiddleware:
+    # Each client gets a token bucket and an in-flight cap per route class, so
+    # one integration looping over full-table lists can't take every pool
+    # connection: excess requests get an immediate 429 with Retry-After
+    # instead of queueing for a connection until they time out.
+    def __init__(self, app, backend=None):
+        self.app = app
+        self.backend = backend or (RedisLimiter(CACHE_URL) if CACHE_URL else MemoryLimiter())
+
+    async def __call__(self, scope, receive, send):
+        route = route_class(scope) if scope["type"] == "http" else None
+        if route is None:
+            return await self.app(scope, receive, send)
+        rate, burst, max_in_flight = LIMITS[route]
+        client = client_key(scope)
+        if rate > 0:
+            wait = await self.backend.take(f"ratelimit:{route}:{client}", rate, burst)
+            if wait > 0:
+                return await _too_many(scope, receive, send, "Rate limit exceeded", wait)
+        if max_in_flight <= 0:
+            return await self.app(scope, receive, send)
+        key = f"inflight:{route}:{client}"
+        if not await self.backend.acquire(key, max_in_flight):
+            return await _too_many(scope, receive, send, "Too many concurrent requests", 1)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            await self.backend.release(key)
+
+
+async def _too_many(scope, receive, send, detail, retry_after):
+    headers = {"Retry-After": str(max(1, math.ceil(retry_after)))}
+    await JSONResponse({"detail": detail}, status_code=429, headers=headers)(scope, receive, send)
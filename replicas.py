@@ -0,0 +1,154 @@
+import itertools
+import logging
+import os
+import threading
+from contextvars import ContextVar
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from starlette.datastructures import Headers
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated URLs of read replicas; empty keeps every query on the primary
+DB_REPLICA_URLS = [url.strip() for url in os.getenv('DB_REPLICA_URLS', '').split(',') if url.strip()]
+# Seconds between replica health checks
+DB_REPLICA_HEALTH_INTERVAL = float(os.getenv('DB_REPLICA_HEALTH_INTERVAL', '5'))
+# A replica further behind than this many seconds is skipped (Postgres)
+DB_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', '10'))
+# After a successful write a client reads from the primary for this long (read-your-writes)
+DB_REPLICA_STICKY_SECONDS = int(os.getenv('DB_REPLICA_STICKY_SECONDS', '5'))
+
+STICKY_COOKIE = "db_primary"
+
+# Set per request by ReplicaRoutingMiddleware: sessions opened while handling a
+# GET / HEAD may read from a replica
+reads_from_replica = ContextVar("reads_from_replica", default=False)
+
+
+class ReplicaSet:
+    # Replica engines with a health flag each, handed out round-robin. With
+    # DB_ASYNC the AsyncEngine for each replica URL is listed in async_engines;
+    # health is always checked through the sync engines.
+    def __init__(self, engines, async_engines=()):
+        self.engines = engines
+        self.async_engines = list(async_engines)
+        self._healthy = {engine: True for engine in engines}
+        self._cycle = itertools.cycle(range(len(engines)))
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        for engine in engines:
+            event.listen(engine, "handle_error", self._on_error)
+
+    def __bool__(self):
+        return bool(self.engines)
+
+    def pick(self, is_async=False):
+        # Next healthy replica (the sync engine to bind to), or None to use the primary
+        with self._lock:
+            for _ in range(len(self.engines)):
+                index = next(self._cycle)
+                if self._healthy[self.engines[index]]:
+                    return self.async_engines[index].sync_engine if is_async else self.engines[index]
+        return None
+
+    def _on_error(self, context):
+        # A replica that drops or refuses connections is taken out until the next good health check
+        if (context.is_disconnect or context.connection is None) and context.engine in self._healthy:
+            self._healthy[context.engine] = False
+
+    def check(self):
+        for engine in self.engines:
+            try:
+                with engine.connect() as conn:
+                    healthy = True
+                    if engine.dialect.name == "postgresql":
+                        # A replica that has replayed all it received isn't behind, however
+                        # long ago the last write on the primary was; only while replay
+                        # trails does the age of the last replayed transaction count
+                        lag = conn.scalar(text(
+                            "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                            "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+                        ))
+                        healthy = lag <= DB_REPLICA_MAX_LAG
+                    else:
+                        conn.execute(text("SELECT 1"))
+            except Exception:
+                healthy = False
+            if healthy != self._healthy[engine]:
+                logger.warning("Replica %s is now %s", engine.url.render_as_string(), "healthy" if healthy else "unhealthy")
+            self._healthy[engine] = healthy
+
+    def start(self):
+        # Health checks in a background thread, from the app lifespan
+        if not self.engines:
+            return
+        self.check()
+
+        def run():
+            while not self._stopping.wait(DB_REPLICA_HEALTH_INTERVAL):
+                self.check()
+
+        threading.Thread(target=run, name="replica-health", daemon=True).start()
+
+    def stop(self):
+        self._stopping.set()
+
+    def stats(self):
+        return {engine.url.render_as_string(): self._healthy[engine] for engine in self.engines}
+
+
+def routing_session_class(replicas, is_async=False):
+    # Session class whose reads go to one replica (pinned for the session's
+    # lifetime, so a request sees a single snapshot) when the session was
+    # opened for a replica-eligible request; flushes and everything else go
+    # to the primary bind
+    class RoutingSession(Session):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.info.setdefault("replica", reads_from_replica.get())
+
+        def get_bind(self, mapper=None, clause=None, **kwargs):
+            if self.info["replica"] and not self._flushing and (clause is None or clause.is_select):
+                replica = self.info.get("replica_engine") or replicas.pick(is_async)
+                if replica is not None:
+                    self.info["replica_engine"] = replica
+                    return replica
+            return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+    return RoutingSession
+
+
+def use_primary(session):
+    # For reads whose result is stored and reused (cache entries), which must
+    # not come from a lagging replica
+    session = getattr(session, "sync_session", session)
+    session.info["replica"] = False
+    session.info.pop("replica_engine", None)
+
+
+class ReplicaRoutingMiddleware:
+    # GET / HEAD requests read from a replica, unless the client wrote within
+    # the last DB_REPLICA_STICKY_SECONDS: successful writes set a short-lived
+    # cookie that pins the client's reads to the primary
+    def __init__(self, app, replicas):
+        self.app = app
+        self.replicas = replicas
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.replicas:
+            return await self.app(scope, receive, send)
+        if scope["method"] in ("GET", "HEAD"):
+            sticky = f"{STICKY_COOKIE}=" in Headers(scope=scope).get("cookie", "")
+            token = reads_from_replica.set(not sticky)
+            try:
+                return await self.app(scope, receive, send)
+            finally:
+                reads_from_replica.reset(token)
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                cookie = f"{STICKY_COOKIE}=1; Max-Age={DB_REPLICA_STICKY_SECONDS}; Path=/; HttpOnly; SameSite=Lax"
+                message.setdefault("headers", []).append((b"set-cookie", cookie.encode()))
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
@@ -0,0 +1,145 @@
+from datetime import date, datetime, timedelta
+from typing import List, Literal, Optional
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import Date, and_, cast, delete, desc, func, insert, literal_column, select
+from sqlalchemy.orm import Session
+from models import (
+    Clients, Masters, Providedservices, Repairparts, Repairsessions,
+    RepairsessionsProvidedservices, RepairsessionsRepairparts, RevenueDaily, Vehicles
+)
+from schemas import ClientBalance, MasterWorkload, PartUsage, RevenuePeriod, ServiceUsage
+
+# All aggregates are computed by the database with GROUP BY; only the
+# grouped rows travel to the API. Postgres is the target, SQLite variants
+# keep the reports usable on a local stand-in database.
+
+
+def _period(db, column, granularity):
+    if db.get_bind().dialect.name == "postgresql":
+        # Inlined (granularity is "day" or "month") so the SELECT and GROUP BY
+        # expressions are identical even with server-side parameter binding
+        return cast(func.date_trunc(literal_column(f"'{granularity}'"), column), Date)
+    return func.date(column, "start of month") if granularity == "month" else func.date(column)
+
+
+def _hours(db, start, end):
+    if db.get_bind().dialect.name == "postgresql":
+        return func.extract("epoch", end - start) / 3600.0
+    return (func.julianday(end) - func.julianday(start)) * 24.0
+
+
+def _in_range(column, date_from, date_to):
+    conditions = []
+    if date_from is not None:
+        conditions.append(column >= date_from)
+    if date_to is not None:
+        conditions.append(column < date_to)
+    return conditions
+
+
+def refresh_revenue_daily(db, days=None):
+    # Recompute the summary for the last `days` days (all history when None),
+    # so a nightly refresh of a short window doesn't rescan all sessions.
+    # Older days keep the figures of their last refresh: a payment recorded
+    # later (paid_sum) or an older session edited or deleted since only shows
+    # once a refresh covers its day again. Schedule a periodic full rebuild
+    # (refresh-reports --days 0), or use source=live where exact figures matter.
+    RevenueDaily.__table__.create(db.get_bind(), checkfirst=True)
+    since = date.today() - timedelta(days=days) if days is not None else None
+    day = _period(db, Repairsessions.date_start, "day")
+    rows = (
+        select(
+            day, func.count(), func.sum(Repairsessions.total_sum), func.sum(Repairsessions.paid_sum), func.now()
+        )
+        .where(*_in_range(Repairsessions.date_start, since, None))
+        .group_by(day)
+    )
+    db.execute(delete(RevenueDaily).where(*_in_range(RevenueDaily.day, since, None)))
+    db.execute(insert(RevenueDaily).from_select(
+        ["day", "sessions", "total_sum", "paid_sum", "refreshed_at"], rows
+    ))
+    db.commit()
+
+
+def reports_router(get_db):
+    router = APIRouter(prefix="/reports")
+
+    @router.get("/revenue", response_model=List[RevenuePeriod])
+    def get_revenue(
+        granularity: Literal["day", "month"] = "day",
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        source: Literal["live", "summary"] = Query("live", description="summary reads the revenue_daily table, as of its last refresh"),
+        db: Session = Depends(get_db),
+    ):
+        if source == "summary":
+            period = _period(db, RevenueDaily.day, granularity)
+            stmt = select(
+                period, func.sum(RevenueDaily.sessions), func.sum(RevenueDaily.total_sum), func.sum(RevenueDaily.paid_sum)
+            ).where(*_in_range(RevenueDaily.day, date_from, date_to))
+        else:
+            period = _period(db, Repairsessions.date_start, granularity)
+            stmt = select(
+                period, func.count(), func.sum(Repairsessions.total_sum), func.sum(Repairsessions.paid_sum)
+            ).where(*_in_range(Repairsessions.date_start, date_from, date_to))
+        rows = db.execute(stmt.group_by(period).order_by(period)).all()
+        return [
+            RevenuePeriod(period=p, sessions=sessions, total_sum=total, paid_sum=paid)
+            for p, sessions, total, paid in rows
+        ]
+
+    @router.get("/outstanding", response_model=List[ClientBalance])
+    def get_outstanding(limit: int = Query(100, ge=1, le=1000), db: Session = Depends(get_db)):
+        outstanding = func.sum(Repairsessions.total_sum - Repairsessions.paid_sum)
+        rows = db.execute(
+            select(Clients.id, Clients.name, func.count(), outstanding)
+            .join(Vehicles, Vehicles.client_id == Clients.id)
+            .join(Repairsessions, Repairsessions.vehicle_id == Vehicles.id)
+            .group_by(Clients.id, Clients.name)
+            .having(outstanding > 0)
+            .order_by(desc(outstanding))
+            .limit(limit)
+        ).all()
+        return [ClientBalance(client_id=i, name=n, sessions=c, outstanding=o) for i, n, c, o in rows]
+
+    @router.get("/masters/workload", response_model=List[MasterWorkload])
+    def get_master_workload(
+        date_from: Optional[datetime] = None,
+        date_to: Optional[datetime] = None,
+        db: Session = Depends(get_db),
+    ):
+        hours = func.coalesce(func.sum(_hours(db, Repairsessions.date_start, Repairsessions.date_end)), 0)
+        rows = db.execute(
+            select(Masters.id, Masters.name, func.count(Repairsessions.id), hours)
+            .outerjoin(Repairsessions, and_(
+                Repairsessions.master_id == Masters.id, *_in_range(Repairsessions.date_start, date_from, date_to)
+            ))
+            .group_by(Masters.id, Masters.name)
+            .order_by(Masters.id)
+        ).all()
+        return [MasterWorkload(master_id=i, name=n, sessions=c, hours=round(float(h), 2)) for i, n, c, h in rows]
+
+    @router.get("/parts/top", response_model=List[PartUsage])
+    def get_top_parts(limit: int = Query(20, ge=1, le=1000), db: Session = Depends(get_db)):
+        amount = func.coalesce(func.sum(RepairsessionsRepairparts.amount), 0)
+        rows = db.execute(
+            select(Repairparts.id, Repairparts.name, func.count(), amount)
+            .join(RepairsessionsRepairparts, RepairsessionsRepairparts.repair_part_id == Repairparts.id)
+            .group_by(Repairparts.id, Repairparts.name)
+            .order_by(desc(amount))
+            .limit(limit)
+        ).all()
+        return [PartUsage(repair_part_id=i, name=n, sessions=c, amount=a) for i, n, c, a in rows]
+
+    @router.get("/services/top", response_model=List[ServiceUsage])
+    def get_top_services(limit: int = Query(20, ge=1, le=1000), db: Session = Depends(get_db)):
+        rows = db.execute(
+            select(Providedservices.id, Providedservices.name, func.count())
+            .join(RepairsessionsProvidedservices, RepairsessionsProvidedservices.provided_service_id == Providedservices.id)
+            .group_by(Providedservices.id, Providedservices.name)
+            .order_by(desc(func.count()))
+            .limit(limit)
+        ).all()
+        return [ServiceUsage(provided_service_id=i, name=n, sessions=c) for i, n, c in rows]
+
+    return router
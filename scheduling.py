@@ -0,0 +1,182 @@
+import zlib
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+from models import Masters, Repairsessions
+from schemas import MasterAvailability, TimeWindow, naive_utc
+
+BOOKING_FIELDS = ("master_id", "date_start", "date_end")
+
+# Longest range /availability accepts
+MAX_AVAILABILITY_RANGE = timedelta(days=92)
+
+# First key of the per-master advisory locks (the second is the master id)
+LOCK_NAMESPACE = zlib.crc32(b"repairsessions.master_id") & 0x7FFFFFFF
+
+EXCLUSION_CONSTRAINT = "repairsessions_master_no_overlap"
+
+
+def _busy(db, master_ids, start, end):
+    # (id, master_id, date_start, date_end) of sessions overlapping [start, end).
+    # Served by ix_repairsessions_master_id_date_end: only sessions ending after
+    # start are read, which for a booking form is the master's upcoming work.
+    return db.execute(
+        select(Repairsessions.id, Repairsessions.master_id, Repairsessions.date_start, Repairsessions.date_end)
+        .where(Repairsessions.master_id.in_(master_ids), Repairsessions.date_end > start, Repairsessions.date_start < end)
+    ).all()
+
+
+def _complete(db, rows):
+    # Fills in the booking fields a PATCH didn't send from the stored row.
+    # Writes that don't touch the schedule are dropped first, so e.g. a PATCH
+    # of paid_sum costs no query.
+    rows = [(index, row) for index, row in rows if any(field in row for field in BOOKING_FIELDS)]
+    partial_ids = [row["id"] for _, row in rows if row.get("id") is not None and not all(f in row for f in BOOKING_FIELDS)]
+    stored = {}
+    if partial_ids:
+        stored = {
+            row.id: row._asdict()
+            for row in db.execute(
+                select(Repairsessions.id, *(getattr(Repairsessions, f) for f in BOOKING_FIELDS))
+                .where(Repairsessions.id.in_(partial_ids))
+            )
+        }
+    for index, row in rows:
+        if not all(field in row for field in BOOKING_FIELDS):
+            if row.get("id") not in stored:
+                continue  # missing row, reported as 404 by the handler
+            row = {**stored[row["id"]], **row}
+        yield index, row
+
+
+def check_bookings(db, rows):
+    # Row check for Repairsessions (registered in main.py): a master can't have
+    # two sessions overlapping in time. All rows of a write are checked with one
+    # query per batch and a sweep per master, which also catches overlaps
+    # between the rows themselves. On Postgres the masters involved are locked
+    # until commit, so concurrent bookings of a master are checked one at a time.
+    errors, bookings = [], []
+    for index, row in _complete(db, rows):
+        if row["date_end"] <= row["date_start"]:
+            errors.append({"index": index, "detail": "date_end must be after date_start", "status": 422})
+        else:
+            bookings.append((index, row.get("id"), row["master_id"], row["date_start"], row["date_end"]))
+    if not bookings:
+        return errors
+
+    masters = sorted({master_id for _, _, master_id, _, _ in bookings})
+    if db.get_bind().dialect.name == "postgresql":
+        # In id order, so two transactions can't wait on each other
+        for master_id in masters:
+            db.execute(select(func.pg_advisory_xact_lock(LOCK_NAMESPACE, master_id)))
+
+    # Stored intervals, minus the rows being rewritten, plus the new ones
+    rewritten = {session_id for _, session_id, _, _, _ in bookings if session_id is not None}
+    start = min(booking[3] for booking in bookings)
+    end = max(booking[4] for booking in bookings)
+    intervals = defaultdict(list)
+    for session_id, master_id, date_start, date_end in _busy(db, masters, start, end):
+        if session_id not in rewritten:
+            intervals[master_id].append((date_start, date_end, None, session_id))
+    for index, session_id, master_id, date_start, date_end in bookings:
+        intervals[master_id].append((date_start, date_end, index, session_id))
+
+    for index, (master_id, (date_start, date_end, other_index, session_id)) in find_overlaps(intervals).items():
+        other = f"repair session {session_id}" if other_index is None else f"item {other_index} of this request"
+        errors.append({
+            "index": index,
+            "detail": f"Master {master_id} is already booked from {date_start} to {date_end} ({other})",
+            "status": 409,
+        })
+    return sorted(errors, key=lambda error: error["index"])
+
+
+def find_overlaps(intervals):
+    # intervals: master_id -> [(date_start, date_end, index, session_id)], index
+    # None for stored sessions. Sweeps each master's intervals in start order,
+    # tracking the one that reaches furthest: any interval starting before its
+    # end overlaps it. Returns {index: (master_id, interval it overlaps)} for
+    # the new intervals, the first conflict of each.
+    conflicts = {}
+    for master_id, items in intervals.items():
+        items = sorted(items, key=lambda item: (item[0], item[1]))
+        reach = None
+        for item in items:
+            if reach is not None and item[0] < reach[1]:
+                new, other = (item, reach) if item[2] is not None else (reach, item)
+                if new[2] is not None and new[2] not in conflicts:
+                    conflicts[new[2]] = (master_id, other)
+            if reach is None or item[1] > reach[1]:
+                reach = item
+    return conflicts
+
+
+def free_windows(busy, start, end, day_start=None, day_end=None, min_length=timedelta(0)):
+    # Gaps between busy (start, end) intervals within [start, end), optionally
+    # clipped to working hours [day_start, day_end) of every day
+    gaps, cursor = [], start
+    for busy_start, busy_end in sorted(busy):
+        if busy_start > cursor:
+            gaps.append((cursor, min(busy_start, end)))
+        cursor = max(cursor, busy_end)
+    if cursor < end:
+        gaps.append((cursor, end))
+    if day_start is not None:
+        clipped = []
+        for gap_start, gap_end in gaps:
+            day = gap_start.date()
+            while day <= gap_end.date():
+                window_start = max(gap_start, datetime.combine(day, day_start))
+                window_end = min(gap_end, datetime.combine(day, day_end))
+                if window_start < window_end:
+                    clipped.append((window_start, window_end))
+                day += timedelta(days=1)
+        gaps = clipped
+    return [(gap_start, gap_end) for gap_start, gap_end in gaps if gap_end - gap_start >= min_length and gap_end > gap_start]
+
+
+def add_booking_constraint(bind):
+    # Optional database-level guarantee on Postgres: an exclusion constraint on
+    # (master_id, [date_start, date_end)). Fails if overlapping sessions exist.
+    with bind.begin() as conn:
+        exists = conn.scalar(text("SELECT 1 FROM pg_constraint WHERE conname = :name"), {"name": EXCLUSION_CONSTRAINT})
+        if exists:
+            return
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS btree_gist"))
+        conn.execute(text(
+            f"ALTER TABLE repairsessions ADD CONSTRAINT {EXCLUSION_CONSTRAINT} "
+            "EXCLUDE USING gist (master_id WITH =, tsrange(date_start, date_end) WITH &&)"
+        ))
+
+
+def scheduling_router(get_db):
+    router = APIRouter()
+
+    @router.get("/masters/{id}/availability", response_model=MasterAvailability)
+    def get_availability(
+        id: int,
+        date_from: datetime,
+        date_to: datetime,
+        day_start: Optional[time] = Query(None, description="Start of working hours, e.g. 09:00"),
+        day_end: Optional[time] = Query(None, description="End of working hours, e.g. 18:00"),
+        min_minutes: int = Query(0, ge=0, description="Shortest window to return"),
+        db: Session = Depends(get_db),
+    ):
+        date_from, date_to = naive_utc(date_from), naive_utc(date_to)
+        if date_to <= date_from or date_to - date_from > MAX_AVAILABILITY_RANGE:
+            raise HTTPException(status_code=422, detail=f"date_to must be after date_from, at most {MAX_AVAILABILITY_RANGE.days} days")
+        if (day_start is None) != (day_end is None) or (day_start is not None and day_end <= day_start):
+            raise HTTPException(status_code=422, detail="day_start and day_end go together, day_end after day_start")
+        if db.get(Masters, id) is None:
+            raise HTTPException(status_code=404, detail="Master not found")
+        busy = [(row.date_start, row.date_end) for row in _busy(db, [id], date_from, date_to)]
+        windows = free_windows(busy, date_from, date_to, day_start, day_end, timedelta(minutes=min_minutes))
+        return MasterAvailability(
+            master_id=id, date_from=date_from, date_to=date_to,
+            free=[TimeWindow(start=start, end=end) for start, end in windows],
+        )
+
+    return router
@@ -1,6 +1,27 @@
-from pydantic import BaseModel, Field
-from typing import Optional
-from datetime import datetime
+from functools import cache
+from pydantic import AfterValidator, BaseModel, Field, create_model
+from pydantic.fields import FieldInfo
+from typing import Annotated, Any, Generic, List, Optional, TypeVar, Union
+from datetime import date, datetime, timezone
+
+
+T = TypeVar("T")
+
+
+def naive_utc(value):
+    # The DateTime columns hold naive UTC: an aware input is converted, so it
+    # compares with stored values and isn't shifted by the session time zone
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def utcnow():
+    # The current time in the DateTime columns' terms
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+UtcDatetime = Annotated[datetime, AfterValidator(naive_utc)]
 
 
 # --- Pydantic Models for each Django Model ---
@@ -110,8 +131,8 @@ class WarrantyCard(BaseModel):
         from_attributes = True
 
 class WarrantyCardCreate(BaseModel):
-    start_date: datetime
-    end_date: datetime
+    start_date: UtcDatetime
+    end_date: UtcDatetime
     vehicle_id: int  # ForeignKey relationship to Vehicle
     provided_service_id: int  # ForeignKey relationship to ProvidedService
 
@@ -136,8 +157,8 @@ class RepairSession(BaseModel):
 
 class RepairSessionCreate(BaseModel):
     order_number: str = Field(..., max_length=50)
-    date_start: datetime
-    date_end: datetime
+    date_start: UtcDatetime
+    date_end: UtcDatetime
     malfunctions: Optional[str] = Field(None, max_length=255)
     order_comment: Optional[str] = Field(None, max_length=255)
     total_sum: int
@@ -148,6 +169,32 @@ class RepairSessionCreate(BaseModel):
     master_id: int  # ForeignKey relationship to Master
 
 
+# Work order: a repair session created together with the parts it uses and its services
+class WorkOrderPart(BaseModel):
+    repair_part_id: int
+    amount: int = Field(..., gt=0)
+
+class WorkOrderCreate(RepairSessionCreate):
+    repair_parts: List[WorkOrderPart] = []
+    provided_service_ids: List[int] = []
+
+
+# Repair session with related rows inlined; only the relations asked for via ?expand= are present
+class RepairSessionPart(BaseModel):
+    repair_part: RepairPart
+    amount: int
+
+    class Config:
+        from_attributes = True
+
+class RepairSessionExpanded(RepairSession):
+    vehicle: Optional[Vehicle] = None
+    responsible: Optional[Responsible] = None
+    master: Optional[Master] = None
+    repair_parts: Optional[List[RepairSessionPart]] = None
+    provided_services: Optional[List[ProvidedService]] = None
+
+
 # Pydantic model for RepairsessionsProvidedservices
 class RepairSessionProvidedService(BaseModel):
     repair_session_id: int  # ForeignKey to RepairSession
@@ -165,3 +212,86 @@ class RepairSessionRepairPart(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+# Keyset-paginated list response; pass next_cursor back as ?after_id= to get the
+# next page, or as ?cursor= for a sorted list (an opaque token then)
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    next_cursor: Optional[Union[int, str]] = None
+
+
+# Result of a /bulk call: what was applied plus the items that were rejected
+class BulkError(BaseModel):
+    index: int  # Position of the item in the request array
+    detail: Any
+
+
+class BulkResult(BaseModel, Generic[T]):
+    items: List[T]
+    errors: List[BulkError]
+
+
+# --- Reports ---
+class RevenuePeriod(BaseModel):
+    period: date
+    sessions: int
+    total_sum: int
+    paid_sum: int
+
+class ClientBalance(BaseModel):
+    client_id: int
+    name: str
+    sessions: int
+    outstanding: int  # sum of total_sum - paid_sum
+
+class MasterWorkload(BaseModel):
+    master_id: int
+    name: str
+    sessions: int
+    hours: float
+
+class PartUsage(BaseModel):
+    repair_part_id: int
+    name: str
+    sessions: int
+    amount: int
+
+class ServiceUsage(BaseModel):
+    provided_service_id: int
+    name: str
+    sessions: int
+
+
+# Free time of a master
+class TimeWindow(BaseModel):
+    start: datetime
+    end: datetime
+
+class MasterAvailability(BaseModel):
+    master_id: int
+    date_from: datetime
+    date_to: datetime
+    free: List[TimeWindow]
+
+
+# /search results, best match first; pass next_offset back as ?offset= for more
+class SearchHit(BaseModel):
+    type: str  # clients, vehicles or repairsessions
+    id: int
+    score: float
+    item: dict  # The row, as the type's read schema
+
+class SearchResults(BaseModel):
+    items: List[SearchHit]
+    next_offset: Optional[int] = None
+
+
+# PATCH body for a *Create schema: same fields and constraints, all optional
+@cache
+def partial(create_schema):
+    fields = {
+        name: (Optional[field.annotation], FieldInfo.merge_field_infos(field, default=None))
+        for name, field in create_schema.model_fields.items()
+    }
+    return create_model(create_schema.__name__.replace("Create", "Patch"), **fields)
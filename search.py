@@ -0,0 +1,215 @@
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import case, func, literal, literal_column, or_, select, text
+from sqlalchemy.orm import Session
+from cache import cache
+from models import Clients, Repairsessions, Vehicles, partitioned_tables
+from pagination import _columns
+from schemas import Client, RepairSession, SearchResults, Vehicle
+
+# Postgres is the target: trigram (pg_trgm) indexes for names and phone
+# numbers, a tsvector index for the repair session notes, all GIN, created by
+# `python manage.py create-search-indexes`. Other databases (SQLite in tests
+# and local runs) get an in-memory trigram index instead.
+
+# Text search configuration of the repair session notes; 'simple' only
+# lowercases, which suits notes in more than one language
+SEARCH_TEXT_CONFIG = os.getenv('SEARCH_TEXT_CONFIG', 'simple')
+if not re.fullmatch(r"\w+", SEARCH_TEXT_CONFIG):
+    raise ValueError(f"SEARCH_TEXT_CONFIG must be a text search configuration name, got {SEARCH_TEXT_CONFIG!r}")
+
+# Trigram indexes can't serve anything shorter
+MIN_QUERY_LENGTH = 3
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+# Every page re-ranks the results before it, so paging stops somewhere
+MAX_SEARCH_OFFSET = 1000
+
+# Fuzzy matches below this word similarity are dropped; the same as the
+# pg_trgm.word_similarity_threshold default that the <% operator uses
+WORD_SIMILARITY_THRESHOLD = 0.6
+
+# type -> (model, read schema, searched columns, kind of index on Postgres)
+SEARCH_TARGETS = {
+    "clients": (Clients, Client, ("name", "telephone"), "trigram"),
+    "vehicles": (Vehicles, Vehicle, ("brand", "model"), "trigram"),
+    "repairsessions": (Repairsessions, RepairSession, ("malfunctions", "order_comment"), "fulltext"),
+}
+
+# The index expression and the query use the same text, so the planner matches them
+SESSION_DOCUMENT = (
+    f"to_tsvector('{SEARCH_TEXT_CONFIG}'::regconfig, coalesce(malfunctions, '') || ' ' || coalesce(order_comment, ''))"
+)
+
+# (table, index name, indexed expression)
+SEARCH_INDEXES = [
+    ("clients", "ix_clients_name_trgm", "name gin_trgm_ops"),
+    ("clients", "ix_clients_telephone_trgm", "telephone gin_trgm_ops"),
+    ("vehicles", "ix_vehicles_brand_trgm", "brand gin_trgm_ops"),
+    ("vehicles", "ix_vehicles_model_trgm", "model gin_trgm_ops"),
+    ("repairsessions", "ix_repairsessions_notes_fts", SESSION_DOCUMENT),
+]
+
+
+def create_search_indexes(bind):
+    # Postgres only; CONCURRENTLY keeps the tables writable, which needs
+    # autocommit (and isn't possible on a partitioned table)
+    with bind.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        partitioned = partitioned_tables(conn)
+        for table, name, expression in SEARCH_INDEXES:
+            concurrently = "" if table in partitioned else " CONCURRENTLY"
+            conn.execute(text(f"CREATE INDEX{concurrently} IF NOT EXISTS {name} ON {table} USING gin ({expression})"))
+
+
+def _escape_like(value):
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _trigram_search(model, columns, q):
+    # Fuzzy word matches (q <% column) plus plain substrings (partial phone
+    # numbers), both served by the gin_trgm_ops indexes. Substrings rank first.
+    substring = or_(*(column.ilike(f"%{_escape_like(q)}%", escape="\\") for column in columns))
+    match = or_(substring, *(literal(q).op("<%")(column) for column in columns))
+    score = func.greatest(case((substring, 1.0), else_=0.0), *(func.word_similarity(q, column) for column in columns))
+    return match, score
+
+
+def _fulltext_search(q):
+    # Every word of q as a prefix ("brak" finds "brakes"), ranked by ts_rank_cd
+    # scaled to 0..1; None when q has no words
+    words = re.findall(r"\w+", q.lower())
+    if not words:
+        return None, None
+    document = literal_column(SESSION_DOCUMENT)
+    query = func.to_tsquery(literal_column(f"'{SEARCH_TEXT_CONFIG}'::regconfig"), " & ".join(f"{word}:*" for word in words))
+    return document.op("@@")(query), func.ts_rank_cd(document, query, 32)
+
+
+def _search_postgres(db, model, schema, fields, kind, q, count):
+    # The best <count> (score, row) of one type
+    if kind == "trigram":
+        match, score = _trigram_search(model, [getattr(model, field) for field in fields], q)
+    else:
+        match, score = _fulltext_search(q)
+        if match is None:
+            return []
+    keys = list(schema.model_fields)
+    rows = db.execute(
+        select(*_columns(model, schema), score.label("search_score"))
+        .where(match)
+        .order_by(literal_column("search_score").desc(), model.id)
+        .limit(count)
+    ).all()
+    return [(float(row.search_score), dict(zip(keys, row))) for row in rows]
+
+
+def _trigrams(value):
+    # pg_trgm style: lowercase words padded with two spaces in front, one behind
+    grams = set()
+    for word in re.findall(r"\w+", value.lower()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    # In-memory stand-in for the Postgres indexes of one type. Built from the
+    # table on first use and rebuilt once a write has moved the table's cache
+    # generation, so it's meant for small local and test databases.
+    def __init__(self, namespace, model, fields):
+        self.namespace = namespace
+        self.model = model
+        self.fields = fields
+        self._generation = None
+        self._postings = {}  # trigram -> ids
+        self._values = {}  # id -> [(lowercased value, its trigrams)]
+        self._lock = threading.Lock()
+
+    def _refresh(self, db):
+        generation = cache.generation(self.namespace)
+        with self._lock:
+            if generation == self._generation:
+                return
+            postings, values = defaultdict(set), {}
+            columns = [getattr(self.model, field) for field in self.fields]
+            for row_id, *row in db.execute(select(self.model.id, *columns)):
+                values[row_id] = [(value.lower(), _trigrams(value)) for value in row if value]
+                for _, grams in values[row_id]:
+                    for gram in grams:
+                        postings[gram].add(row_id)
+            self._postings, self._values, self._generation = postings, values, generation
+
+    def search(self, db, q, count):
+        # The best <count> (score, id), scored like the Postgres queries
+        self._refresh(db)
+        needle, grams = q.lower(), _trigrams(q)
+        candidates = Counter()
+        for gram in grams:
+            candidates.update(self._postings.get(gram, ()))
+        hits = []
+        for row_id in candidates:
+            score = max(
+                1.0 if needle in value else len(grams & value_grams) / len(grams)
+                for value, value_grams in self._values[row_id]
+            )
+            if score >= WORD_SIMILARITY_THRESHOLD:
+                hits.append((score, row_id))
+        hits.sort(key=lambda hit: (-hit[0], hit[1]))
+        return hits[:count]
+
+
+def _search_fallback(db, index, model, schema, q, count):
+    hits = index.search(db, q, count)
+    if not hits:
+        return []
+    keys = list(schema.model_fields)
+    rows = {row.id: dict(zip(keys, row)) for row in db.execute(
+        select(*_columns(model, schema)).where(model.id.in_([row_id for _, row_id in hits]))
+    )}
+    return [(score, rows[row_id]) for score, row_id in hits if row_id in rows]
+
+
+def search_router(get_db):
+    router = APIRouter()
+    indexes = {name: TrigramIndex(name, model, fields) for name, (model, _, fields, _) in SEARCH_TARGETS.items()}
+
+    @router.get("/search", response_model=SearchResults)
+    def search(
+        q: str = Query(..., min_length=MIN_QUERY_LENGTH, max_length=100),
+        types: Optional[str] = Query(None, description=f"Comma-separated subset of {', '.join(SEARCH_TARGETS)}"),
+        limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT),
+        offset: int = Query(0, ge=0, le=MAX_SEARCH_OFFSET),
+        db: Session = Depends(get_db),
+    ):
+        # Clients by name or (partial) phone, vehicles by brand or model, repair
+        # sessions by words in their notes; all types merged, best match first
+        names = [name.strip() for name in types.split(",")] if types else list(SEARCH_TARGETS)
+        unknown = [name for name in names if name not in SEARCH_TARGETS]
+        if unknown:
+            raise HTTPException(status_code=422, detail=f"Unknown type(s): {', '.join(unknown)}")
+        q = q.strip()
+        # Each type's best offset + limit + 1 rows are enough to rank the page
+        # and tell whether another one follows
+        count = offset + limit + 1
+        postgres = db.get_bind().dialect.name == "postgresql"
+        hits = []
+        for order, name in enumerate(dict.fromkeys(names)):
+            model, schema, fields, kind = SEARCH_TARGETS[name]
+            if postgres:
+                results = _search_postgres(db, model, schema, fields, kind, q, count)
+            else:
+                results = _search_fallback(db, indexes[name], model, schema, q, count)
+            hits.extend((score, order, item["id"], name, item) for score, item in results)
+        hits.sort(key=lambda hit: (-hit[0], hit[1], hit[2]))
+        page = hits[offset:offset + limit]
+        return {
+            "items": [{"type": name, "id": row_id, "score": round(score, 4), "item": item} for score, _, row_id, name, item in page],
+            "next_offset": offset + limit if len(hits) > offset + limit else None,
+        }
+
+    return router
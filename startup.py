@@ -0,0 +1,124 @@
+import time
+
+# Taken when main.py starts importing (this is its first import), so the
+# import time reported below covers the whole app: FastAPI, SQLAlchemy,
+# models, schemas and route setup
+IMPORT_STARTED = time.perf_counter()
+
+import logging
+import os
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import configure_mappers
+from sqlalchemy.pool import QueuePool
+from pagination import paginate, paginate_async
+
+logger = logging.getLogger(__name__)
+
+# Connections opened per pool before the worker takes traffic (capped at DB_POOL_SIZE)
+DB_POOL_PREWARM = int(os.getenv('DB_POOL_PREWARM', '2'))
+# Import plus lifespan startup above this many seconds is logged as a warning
+STARTUP_BUDGET_SECONDS = float(os.getenv('STARTUP_BUDGET_SECONDS', '5'))
+
+
+class Readiness:
+    # Startup progress and timings of this worker, reported by /readyz
+    def __init__(self):
+        self.ready = False
+        self.timings = {}
+
+    def imported(self):
+        # Called at the end of main.py
+        self.timings["import_seconds"] = round(time.perf_counter() - IMPORT_STARTED, 3)
+
+    def started(self, startup_seconds):
+        self.timings["startup_seconds"] = round(startup_seconds, 3)
+        total = self.timings.get("import_seconds", 0) + startup_seconds
+        logger.info("Worker ready: %s", self.timings)
+        if total > STARTUP_BUDGET_SECONDS:
+            logger.warning("Startup took %.2fs, over the %.2fs budget: %s", total, STARTUP_BUDGET_SECONDS, self.timings)
+        self.ready = True
+
+
+readiness = Readiness()
+
+
+def check_database(engine):
+    # Raises if the database can't be reached with the configured URL and credentials
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+def prewarm_pool(engine, count=DB_POOL_PREWARM):
+    # Opens connections up front and returns them to the pool, so the first
+    # requests of a fresh worker don't each pay for a connect (TLS, auth).
+    # Nothing to do without a pool of our own (DB_EXTERNAL_POOLER).
+    if not isinstance(engine.pool, QueuePool):
+        return 0
+    connections = []
+    try:
+        for _ in range(min(count, engine.pool.size())):
+            connections.append(engine.connect())
+    finally:
+        for connection in connections:
+            connection.close()
+    return len(connections)
+
+
+async def prewarm_async_pool(engine, count=DB_POOL_PREWARM):
+    if not isinstance(engine.pool, QueuePool):
+        return 0
+    connections = []
+    try:
+        for _ in range(min(count, engine.pool.size())):
+            connections.append(await engine.connect().start())
+    finally:
+        for connection in connections:
+            await connection.close()
+    return len(connections)
+
+
+def warm_statements(session_factory, resources):
+    # Configures the mappers and compiles the statements every resource serves
+    # most (first page, next page, get by id) into the engine's compiled
+    # cache, which the first requests would otherwise do one by one
+    configure_mappers()
+    with session_factory() as db:
+        for _, model, schema, *_ in resources:
+            paginate(db, model, schema, None, 1)
+            paginate(db, model, schema, 0, 1)
+            db.get(model, 0)
+
+
+async def warm_statements_async(session_factory, resources):
+    async with session_factory() as db:
+        for _, model, schema, *_ in resources:
+            await paginate_async(db, model, schema, None, 1)
+            await paginate_async(db, model, schema, 0, 1)
+            await db.get(model, 0)
+
+
+def health_router(engine):
+    router = APIRouter()
+
+    @router.get("/healthz")
+    def healthz():
+        # Liveness: the process serves requests; never touches the database
+        return {"status": "ok"}
+
+    @router.get("/readyz")
+    def readyz():
+        # Readiness: startup finished and the database answers
+        if not readiness.ready:
+            return JSONResponse({"status": "starting"}, status_code=503)
+        try:
+            check_database(engine)
+        except SQLAlchemyError as exc:
+            # The driver error can carry host names and credentials: log it, don't answer with it
+            logger.warning("Readiness check failed: %s", exc.__cause__ or exc)
+            return JSONResponse({"status": "unavailable"}, status_code=503)
+        return {"status": "ready", **readiness.timings}
+
+    return router
@@ -0,0 +1,114 @@
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel, ConfigDict
+from sqlalchemy import Column, ForeignKey, Integer, String, create_engine, event, insert, select
+from sqlalchemy.exc import DataError
+from sqlalchemy.orm import Session, declarative_base
+from sqlalchemy.pool import StaticPool
+from bulk import _execute_rows, add_bulk_routes
+
+Base = declarative_base()
+
+
+class Owner(Base):
+    __tablename__ = "owners"
+    id = Column(Integer, primary_key=True)
+    name = Column(String(50), unique=True, nullable=False)
+
+
+class Car(Base):
+    __tablename__ = "cars"
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, ForeignKey("owners.id"), nullable=False)
+
+
+class OwnerCreate(BaseModel):
+    name: str
+
+
+class OwnerRead(OwnerCreate):
+    model_config = ConfigDict(from_attributes=True)
+    id: int
+
+
+def make_db():
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    event.listen(engine, "connect", lambda conn, _: conn.execute("PRAGMA foreign_keys=ON"))
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def make_client(engine):
+    def get_db():
+        with Session(engine) as db:
+            yield db
+
+    router = APIRouter()
+    add_bulk_routes(router, "/owners/", Owner, OwnerRead, OwnerCreate, get_db)
+    app = FastAPI()
+    app.include_router(router)
+    return TestClient(app)
+
+
+def names(engine):
+    with Session(engine) as db:
+        return list(db.scalars(select(Owner.name).order_by(Owner.id)))
+
+
+# --- Partial failures ---
+def test_bulk_create_reports_rejected_items_and_keeps_the_rest():
+    engine = make_db()
+    client = make_client(engine)
+    response = client.post("/owners/bulk", json=[{"name": "Anna"}, {"name": "Anna"}, {}, {"name": "Boris"}])
+    result = response.json()
+    assert response.status_code == 200
+    assert [item["name"] for item in result["items"]] == ["Anna", "Boris"]
+    assert [error["index"] for error in result["errors"]] == [1, 2]
+    assert "UNIQUE" in result["errors"][0]["detail"]
+    assert names(engine) == ["Anna", "Boris"]
+
+
+def test_bulk_update_reports_missing_and_conflicting_items():
+    engine = make_db()
+    client = make_client(engine)
+    client.post("/owners/bulk", json=[{"name": "Anna"}, {"name": "Boris"}])
+    response = client.put("/owners/bulk", json=[
+        {"id": 1, "name": "Anne"}, {"id": 2, "name": "Anne"}, {"id": 9, "name": "Vera"},
+    ])
+    result = response.json()
+    assert [item["name"] for item in result["items"]] == ["Anne"]
+    assert [(error["index"], error["detail"] == "Not found") for error in result["errors"]] == [(1, False), (2, True)]
+    assert names(engine) == ["Anne", "Boris"]
+
+
+def test_bulk_delete_keeps_referenced_rows():
+    engine = make_db()
+    client = make_client(engine)
+    client.post("/owners/bulk", json=[{"name": "Anna"}, {"name": "Boris"}])
+    with Session(engine) as db:
+        db.execute(insert(Car).values(owner_id=1))
+        db.commit()
+    result = client.request("DELETE", "/owners/bulk", json=[1, 2, 9]).json()
+    assert result["items"] == [2]
+    assert [(error["index"], error["detail"] == "Not found") for error in result["errors"]] == [(0, False), (2, True)]
+    assert names(engine) == ["Anna"]
+
+
+def test_rows_rejected_for_other_database_errors_are_reported():
+    # e.g. an integer out of range, which Postgres raises as a DataError
+    engine = make_db()
+    with Session(engine) as db:
+        execute = db.execute
+
+        def reject_vera(stmt, params=None, **kwargs):
+            if params and any(row["name"] == "Vera" for row in params):
+                raise DataError("INSERT", params, Exception("value out of range"))
+            return execute(stmt, params, **kwargs)
+
+        db.execute = reject_vera
+        errors = []
+        rows = [(0, {"name": "Anna"}), (1, {"name": "Vera"}), (2, {"name": "Boris"})]
+        applied, created = _execute_rows(db, insert(Owner).returning(Owner), rows, errors)
+        assert [index for index, _ in applied] == [0, 2]
+        assert [owner.name for owner in created] == ["Anna", "Boris"]
+        assert errors == [{"index": 1, "detail": "value out of range"}]
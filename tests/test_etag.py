@@ -0,0 +1,110 @@
+import asyncio
+import httpx
+import etag
+from starlette.responses import JSONResponse
+from cache import Cache, MemoryBackend
+from etag import ETagMiddleware
+from replicas import reads_from_replica
+
+
+class SharedBackend:
+    # Stands in for Redis: not a MemoryBackend, so the cache counts as shared
+    def __init__(self):
+        self._backend = MemoryBackend()
+
+    def __getattr__(self, name):
+        return getattr(self._backend, name)
+
+
+def make_app(body):
+    # body is a one-item list so a test can change it between requests
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(scope["path"])
+        await JSONResponse(body[0])(scope, receive, send)
+
+    return ETagMiddleware(app), calls
+
+
+def get(app, path, if_none_match=None):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            headers = {"If-None-Match": if_none_match} if if_none_match else {}
+            return await client.get(path, headers=headers)
+
+    return asyncio.run(run())
+
+
+# --- Body hashes ---
+def test_unchanged_body_is_not_modified():
+    body = [{"id": 7, "name": "Boris"}]
+    app, calls = make_app(body)
+    first = get(app, "/clients/7")
+    tag = first.headers["etag"]
+    second = get(app, "/clients/7", tag)
+    assert (second.status_code, second.content, second.headers["etag"]) == (304, b"", tag)
+    body[0] = {"id": 7, "name": "Anna"}
+    third = get(app, "/clients/7", tag)
+    assert third.status_code == 200 and third.headers["etag"] != tag
+    assert len(calls) == 3
+
+
+def test_weak_and_listed_tags_match():
+    app, _ = make_app([{"id": 7}])
+    tag = get(app, "/clients/7").headers["etag"]
+    assert get(app, "/clients/7", f'"other", W/{tag}').status_code == 304
+    assert get(app, "/clients/7", "*").status_code == 304
+
+
+def test_non_json_and_writes_are_not_tagged():
+    async def text(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    assert "etag" not in get(ETagMiddleware(text), "/metrics").headers
+
+    async def run():
+        app, _ = make_app([{"id": 7}])
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/clients/")
+
+    assert "etag" not in asyncio.run(run()).headers
+
+
+# --- Collection generations ---
+def test_list_answered_from_generation_without_running_handler(monkeypatch):
+    shared = Cache(SharedBackend())
+    monkeypatch.setattr(etag, "cache", shared)
+    monkeypatch.setitem(etag.COLLECTION_PATHS, "/clients/", "clients")
+    app, calls = make_app([{"items": []}])
+    tag = get(app, "/clients/?limit=5").headers["etag"]
+    assert get(app, "/clients/?limit=5", tag).status_code == 304
+    assert get(app, "/clients/?limit=10", tag).status_code == 200
+    shared.invalidate("clients")
+    assert get(app, "/clients/?limit=5", tag).status_code == 200
+    assert calls == ["/clients/"] * 3
+
+
+def test_list_hashed_without_shared_cache(monkeypatch):
+    monkeypatch.setattr(etag, "cache", Cache(MemoryBackend()))
+    monkeypatch.setitem(etag.COLLECTION_PATHS, "/clients/", "clients")
+    app, calls = make_app([{"items": []}])
+    tag = get(app, "/clients/").headers["etag"]
+    assert not tag.startswith("W/")
+    assert get(app, "/clients/", tag).status_code == 304
+    assert len(calls) == 2
+
+
+def test_list_read_from_replica_is_hashed(monkeypatch):
+    monkeypatch.setattr(etag, "cache", Cache(SharedBackend()))
+    monkeypatch.setitem(etag.COLLECTION_PATHS, "/clients/", "clients")
+    app, _ = make_app([{"items": []}])
+    token = reads_from_replica.set(True)
+    try:
+        tag = get(app, "/clients/").headers["etag"]
+    finally:
+        reads_from_replica.reset(token)
+    assert not tag.startswith("W/")
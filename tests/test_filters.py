@@ -0,0 +1,26 @@
+from datetime import datetime
+import pytest
+from fastapi import HTTPException
+from filters import decode_cursor, encode_cursor
+from models import Clients, Repairsessions
+
+
+# --- Sorted list cursors ---
+def test_cursor_round_trip():
+    name = Clients.__table__.c.name
+    assert decode_cursor(name, encode_cursor("Boris", 3)) == ("Boris", 3)
+    date_start = Repairsessions.__table__.c.date_start
+    value = datetime(2024, 3, 1, 9, 30)
+    assert decode_cursor(date_start, encode_cursor(value, 7)) == (value, 7)
+
+
+@pytest.mark.parametrize("raw", ["xx", encode_cursor(5, 3), encode_cursor("Boris", "3"), encode_cursor("Boris", None)])
+def test_invalid_cursor_is_rejected(raw):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(Clients.__table__.c.name, raw)
+    assert error.value.status_code == 422
+
+
+def test_bool_is_not_an_int_cursor():
+    with pytest.raises(HTTPException):
+        decode_cursor(Repairsessions.__table__.c.total_sum, encode_cursor(True, 1))
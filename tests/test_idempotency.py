@@ -0,0 +1,149 @@
+import asyncio
+import httpx
+import pytest
+from starlette.responses import JSONResponse
+from cache import MemoryBackend
+from idempotency import IdempotencyMiddleware
+
+
+class SharedStore:
+    # Not a MemoryBackend, so the middleware calls it off the event loop as it
+    # does the Redis store
+    def __init__(self):
+        self._backend = MemoryBackend()
+
+    def __getattr__(self, name):
+        return getattr(self._backend, name)
+
+
+def make_app(statuses=(201,), gate=None, store=MemoryBackend):
+    # Counts the requests that reach the handler and answers the n-th with
+    # statuses[n] (the last one from then on); gate, if given, holds them
+    calls = []
+
+    async def app(scope, receive, send):
+        message = await receive()
+        calls.append(message["body"])
+        if gate is not None:
+            await gate.wait()
+        response = JSONResponse({"call": len(calls)}, status_code=statuses[min(len(calls), len(statuses)) - 1])
+        await response(scope, receive, send)
+
+    return IdempotencyMiddleware(app, backend=store()), calls
+
+
+def post(client, body=b'{"name": "Boris"}', key="abc"):
+    return client.post("/clients/", content=body, headers={"Idempotency-Key": key})
+
+
+async def with_client(app, run):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        return await run(client)
+
+
+# --- Replay ---
+def test_retry_gets_the_stored_response():
+    app, calls = make_app()
+
+    async def run(client):
+        return await post(client), await post(client)
+
+    first, second = asyncio.run(with_client(app, run))
+    assert len(calls) == 1
+    assert (first.status_code, second.status_code) == (201, 201)
+    assert first.json() == second.json() == {"call": 1}
+    assert "idempotent-replayed" not in first.headers
+    assert second.headers["idempotent-replayed"] == "true"
+
+
+def test_requests_without_a_key_are_not_stored():
+    app, calls = make_app()
+
+    async def run(client):
+        return [await client.post("/clients/", content=b"{}") for _ in range(2)]
+
+    responses = asyncio.run(with_client(app, run))
+    assert len(calls) == 2
+    assert [response.json()["call"] for response in responses] == [1, 2]
+
+
+def test_key_reused_for_a_different_body_is_rejected():
+    app, calls = make_app()
+
+    async def run(client):
+        return await post(client), await post(client, body=b'{"name": "Anna"}')
+
+    first, second = asyncio.run(with_client(app, run))
+    assert first.status_code == 201
+    assert second.status_code == 422
+    assert len(calls) == 1
+
+
+def test_invalid_key_is_rejected():
+    app, calls = make_app()
+    response = asyncio.run(with_client(app, lambda client: post(client, key="x" * 256)))
+    assert response.status_code == 422
+    assert calls == []
+
+
+# --- Failures ---
+def test_server_errors_can_be_retried():
+    app, calls = make_app(statuses=(500, 201))
+
+    async def run(client):
+        return await post(client), await post(client)
+
+    first, second = asyncio.run(with_client(app, run))
+    assert (first.status_code, second.status_code) == (500, 201)
+    assert len(calls) == 2
+    assert "idempotent-replayed" not in second.headers
+
+
+def test_key_held_by_another_worker_is_a_conflict():
+    app, calls = make_app()
+    app.store.add("idempotency:abc:lock", "other", 60)
+    response = asyncio.run(with_client(app, post))
+    assert response.status_code == 409
+    assert response.headers["retry-after"] == "1"
+    assert calls == []
+
+
+# --- Concurrent retries ---
+@pytest.mark.parametrize("store", [MemoryBackend, SharedStore])
+def test_concurrent_retries_collapse_into_one_request(store):
+    async def run():
+        gate = asyncio.Event()
+        app, calls = make_app(gate=gate, store=store)
+
+        async def both(client):
+            requests = asyncio.gather(post(client), post(client), post(client))
+            await asyncio.sleep(0.05)
+            gate.set()
+            return await requests, calls
+
+        return await with_client(app, both)
+
+    responses, calls = asyncio.run(run())
+    assert len(calls) == 1
+    assert [response.json() for response in responses] == [{"call": 1}] * 3
+    assert sorted(response.headers.get("idempotent-replayed", "") for response in responses) == ["", "true", "true"]
+
+
+def test_concurrent_request_with_a_different_body_is_rejected():
+    async def run():
+        gate = asyncio.Event()
+        app, calls = make_app(gate=gate)
+
+        async def both(client):
+            first = asyncio.create_task(post(client))
+            await asyncio.sleep(0.05)
+            second = await post(client, body=b'{"name": "Anna"}')
+            gate.set()
+            return await first, second, calls
+
+        return await with_client(app, both)
+
+    first, second, calls = asyncio.run(run())
+    assert (first.status_code, second.status_code) == (201, 422)
+    assert len(calls) == 1
@@ -0,0 +1,130 @@
+import asyncio
+import httpx
+import ratelimit
+from starlette.responses import JSONResponse
+from etag import COLLECTION_PATHS
+from ratelimit import MemoryLimiter, RateLimitMiddleware, client_key, route_class
+
+
+def request(path, method="GET", headers=(), client=("10.0.0.1", 5000)):
+    return {"type": "http", "path": path, "method": method, "headers": list(headers), "client": client}
+
+
+# --- Route classes ---
+def test_route_classes(monkeypatch):
+    monkeypatch.setitem(COLLECTION_PATHS, "/masters/", "masters")
+    monkeypatch.setitem(COLLECTION_PATHS, "/clients/", "clients")
+    assert route_class(request("/masters/")) == "light"
+    assert route_class(request("/clients/")) == "heavy"
+    assert route_class(request("/clients/", "POST")) == "light"
+    assert route_class(request("/clients/7")) == "light"
+    assert route_class(request("/clients/bulk", "POST")) == "heavy"
+    assert route_class(request("/clients/export")) == "heavy"
+    assert route_class(request("/reports/revenue")) == "heavy"
+    assert route_class(request("/healthz")) is None
+    assert route_class(request("/events/stream")) is None
+
+
+def test_client_key_only_trusts_issued_api_keys(monkeypatch):
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_API_KEYS", {"issued"})
+    issued = client_key(request("/clients/", headers=[(b"x-api-key", b"issued")]))
+    assert issued.startswith("key:") and "issued" not in issued
+    assert client_key(request("/clients/", headers=[(b"x-api-key", b"made-up")])) == "ip:10.0.0.1"
+
+
+def test_forwarded_for_is_ignored_unless_trusted(monkeypatch):
+    scope = request("/clients/", headers=[(b"x-forwarded-for", b"1.2.3.4, 10.0.0.1")])
+    assert client_key(scope) == "ip:10.0.0.1"
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_TRUST_FORWARDED", True)
+    assert client_key(scope) == "ip:1.2.3.4"
+
+
+# --- Memory backend ---
+def test_bucket_allows_a_burst_then_waits():
+    limiter = MemoryLimiter()
+
+    async def run():
+        return [await limiter.take("a", 2, 3) for _ in range(4)], await limiter.take("b", 2, 3)
+
+    waits, other = asyncio.run(run())
+    assert waits[:3] == [0, 0, 0]
+    assert 0.4 < waits[3] <= 0.5
+    assert other == 0
+
+
+def test_in_flight_cap_and_release():
+    limiter = MemoryLimiter()
+
+    async def run():
+        taken = [await limiter.acquire("a", 2) for _ in range(3)]
+        await limiter.release("a")
+        return taken, await limiter.acquire("a", 2)
+
+    assert asyncio.run(run()) == ([True, True, False], True)
+
+
+def test_least_recently_seen_clients_are_dropped():
+    limiter = MemoryLimiter(max_clients=2)
+
+    async def run():
+        for key in ("a", "b", "c"):
+            await limiter.take(key, 1, 1)
+        # "a" was dropped, so it starts again with a full bucket
+        return await limiter.take("a", 1, 1), await limiter.take("c", 1, 1)
+
+    fresh, exhausted = asyncio.run(run())
+    assert fresh == 0 and exhausted > 0
+
+
+# --- Middleware ---
+async def ok(scope, receive, send):
+    await JSONResponse({"ok": True})(scope, receive, send)
+
+
+def get_many(app, count, path="/clients/7"):
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [await client.get(path) for _ in range(count)]
+
+    return asyncio.run(run())
+
+
+def test_requests_over_the_burst_get_429(monkeypatch):
+    monkeypatch.setitem(ratelimit.LIMITS, "light", (1, 2, 0))
+    responses = get_many(RateLimitMiddleware(ok, backend=MemoryLimiter()), 3)
+    assert [response.status_code for response in responses] == [200, 200, 429]
+    assert responses[2].headers["retry-after"] == "1"
+    assert responses[2].json() == {"detail": "Rate limit exceeded"}
+
+
+def test_exempt_paths_are_never_limited(monkeypatch):
+    monkeypatch.setitem(ratelimit.LIMITS, "light", (1, 1, 0))
+    responses = get_many(RateLimitMiddleware(ok, backend=MemoryLimiter()), 3, "/healthz")
+    assert [response.status_code for response in responses] == [200, 200, 200]
+
+
+def test_concurrent_requests_over_the_cap_get_429(monkeypatch):
+    monkeypatch.setitem(ratelimit.LIMITS, "light", (0, 0, 1))
+    gate = asyncio.Event()
+
+    async def slow(scope, receive, send):
+        await gate.wait()
+        await ok(scope, receive, send)
+
+    limiter = MemoryLimiter()
+    app = RateLimitMiddleware(slow, backend=limiter)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = asyncio.create_task(client.get("/clients/7"))
+            await asyncio.sleep(0.05)
+            second = await client.get("/clients/7")
+            gate.set()
+            return await first, second, await limiter.acquire("inflight:light:ip:127.0.0.1", 1)
+
+    first, second, released = asyncio.run(run())
+    assert (first.status_code, second.status_code) == (200, 429)
+    assert second.json() == {"detail": "Too many concurrent requests"}
+    assert released
@@ -0,0 +1,82 @@
+from datetime import datetime, time, timedelta, timezone
+from schemas import RepairSessionCreate, naive_utc, partial
+from scheduling import _complete, find_overlaps, free_windows
+
+
+def at(hour, minute=0, day=1):
+    return datetime(2024, 3, day, hour, minute)
+
+
+# --- Time zones ---
+def test_naive_utc_converts_aware_values():
+    kyiv = timezone(timedelta(hours=2))
+    assert naive_utc(datetime(2024, 3, 1, 10, tzinfo=kyiv)) == at(8)
+    assert naive_utc(at(8)) == at(8)
+    assert naive_utc(None) is None
+
+
+def test_session_schemas_store_naive_utc():
+    item = {
+        "order_number": "A-1", "date_start": "2024-03-01T10:00:00+02:00", "date_end": "2024-03-01T12:00:00Z",
+        "total_sum": 0, "paid_sum": 0, "if_finished": False, "vehicle_id": 1, "responsible_id": 1, "master_id": 1,
+    }
+    row = RepairSessionCreate.model_validate(item)
+    assert (row.date_start, row.date_end) == (at(8), at(12))
+    patch = partial(RepairSessionCreate).model_validate({"date_start": "2024-03-01T10:00:00+02:00"})
+    assert patch.date_start == at(8)
+
+
+# --- Booking sweep ---
+def test_no_overlap_when_intervals_touch():
+    intervals = {1: [(at(8), at(10), None, 5), (at(10), at(12), 0, None)]}
+    assert find_overlaps(intervals) == {}
+
+
+def test_new_interval_overlapping_stored_session():
+    stored = (at(8), at(11), None, 5)
+    intervals = {1: [stored, (at(10), at(12), 0, None)]}
+    assert find_overlaps(intervals) == {0: (1, stored)}
+
+
+def test_new_interval_starting_first_is_reported():
+    stored = (at(10), at(12), None, 5)
+    new = (at(9), at(11), 0, None)
+    assert find_overlaps({1: [stored, new]}) == {0: (1, stored)}
+
+
+def test_overlap_with_long_interval_further_back():
+    # The second stored session ends early; the first still reaches past the new one
+    long = (at(8), at(18), None, 5)
+    intervals = {1: [long, (at(9), at(10), None, 6), (at(14), at(15), 0, None)]}
+    assert find_overlaps(intervals) == {0: (1, long)}
+
+
+def test_overlaps_between_new_rows_and_masters_kept_apart():
+    first, second = (at(8), at(10), 0, None), (at(9), at(11), 1, None)
+    intervals = {1: [first, second], 2: [(at(9), at(11), 2, None)]}
+    assert find_overlaps(intervals) == {1: (1, first)}
+
+
+# --- Availability ---
+def test_free_windows_between_busy_intervals():
+    busy = [(at(10), at(11)), (at(9), at(10)), (at(13), at(14))]
+    assert free_windows(busy, at(8), at(16)) == [(at(8), at(9)), (at(11), at(13)), (at(14), at(16))]
+
+
+def test_free_windows_clipped_to_working_hours():
+    busy = [(at(12, day=1), at(10, day=2))]
+    windows = free_windows(busy, at(0, day=1), at(0, day=3), time(9), time(18))
+    assert windows == [(at(9, day=1), at(12, day=1)), (at(10, day=2), at(18, day=2))]
+
+
+def test_free_windows_min_length_and_busy_outside_range():
+    busy = [(at(6), at(8, 30)), (at(9), at(12))]
+    assert free_windows(busy, at(8), at(13), min_length=timedelta(hours=1)) == [(at(12), at(13))]
+
+
+def test_writes_off_the_schedule_cost_no_query():
+    class NoDatabase:
+        def execute(self, *args):
+            raise AssertionError("no query expected")
+
+    assert list(_complete(NoDatabase(), [(0, {"id": 1, "paid_sum": 5})])) == []
@@ -0,0 +1,263 @@
+import csv
+import io
+import itertools
+import queue
+import threading
+from functools import cache as memoize
+from typing import List, Literal
+import anyio
+import orjson
+from fastapi import Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import TypeAdapter, ValidationError, create_model
+from sqlalchemy import insert, select
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from bulk import check_rows
+from cache import cache
+from events import broker
+from models import SessionLocal, partitioned_tables, sync_id_sequences
+from partitions import has_id_map
+from pagination import STREAM_CHUNK_SIZE, _columns, ndjson_chunks
+
+# Rows validated and written per round trip on import
+IMPORT_BATCH_SIZE = 5000
+# Chunks of COPY output buffered between the database and the response
+COPY_QUEUE_SIZE = 16
+# Validation errors reported for a rejected import
+MAX_REPORTED_ERRORS = 20
+
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+# CSV: the header row names the columns, an empty cell is NULL (as with
+# COPY ... CSV), so an empty string can't be imported into a non-null column.
+# An "id" column keeps the given ids (into a partitioned table only with its id map);
+# otherwise the id sequences assign them.
+
+
+@memoize
+def _with_id(create_schema):
+    return create_model(f"{create_schema.__name__}Import", __base__=create_schema, id=(int, ...))
+
+
+def _copy_supported(bind):
+    return bind.dialect.name == "postgresql" and bind.dialect.driver == "psycopg2"
+
+
+# --- Export ---
+class _CopySink:
+    # File-like target of COPY TO; hands chunks to the response through a bounded queue
+    def __init__(self):
+        self.chunks = queue.Queue(maxsize=COPY_QUEUE_SIZE)
+        self.cancelled = threading.Event()
+
+    def write(self, data):
+        while not self.cancelled.is_set():
+            try:
+                return self.chunks.put(data, timeout=1)
+            except queue.Full:
+                pass
+        # Client went away: raising aborts the COPY
+        raise OSError("export cancelled")
+
+
+def _copy_out(db, model, schema):
+    # COPY (SELECT ...) TO STDOUT runs in a helper thread on the session's
+    # connection (psycopg2 only offers a blocking copy_expert); chunks are
+    # yielded as the server produces them
+    query = select(*_columns(model, schema)).order_by(model.id)
+    query = query.compile(db.get_bind(), compile_kwargs={"literal_binds": True})
+    sink = _CopySink()
+
+    def produce():
+        try:
+            with db.connection().connection.cursor() as cursor:
+                cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", sink)
+            sink.chunks.put(None)
+        except Exception as e:
+            if not sink.cancelled.is_set():
+                sink.chunks.put(e)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while (chunk := sink.chunks.get()) is not None:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+    finally:
+        # Stops a COPY still running (client disconnected) before the session closes
+        sink.cancelled.set()
+        producer.join()
+
+
+def _csv_rows(db, model, schema):
+    # Same output as COPY ... CSV HEADER, for other databases
+    keys = list(schema.model_fields)
+    cell = lambda value: "" if value is None else str(value).lower() if isinstance(value, bool) else value
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(keys)
+    stmt = select(*_columns(model, schema)).order_by(model.id).execution_options(yield_per=STREAM_CHUNK_SIZE)
+    for chunk in db.execute(stmt).partitions():
+        writer.writerows([cell(value) for value in row] for row in chunk)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _csv_chunks(model, schema):
+    # Owns its session for the lifetime of the stream, like ndjson_chunks
+    with SessionLocal() as db:
+        if _copy_supported(db.get_bind()):
+            yield from _copy_out(db, model, schema)
+        else:
+            yield from _csv_rows(db, model, schema)
+
+
+def export_rows(model, schema, fmt):
+    # Iterator of encoded chunks of the whole table, ordered by id
+    return ndjson_chunks(model, schema) if fmt == "ndjson" else _csv_chunks(model, schema)
+
+
+# --- Import ---
+def _records(stream, fmt):
+    # (line number, dict) per record of a text stream
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            if None in record:
+                raise HTTPException(status_code=422, detail=f"Line {reader.line_num}: more cells than columns")
+            yield reader.line_num, {key: value if value != "" else None for key, value in record.items()}
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = orjson.loads(line)
+        except orjson.JSONDecodeError as e:
+            raise HTTPException(status_code=422, detail=f"Line {line_number}: {e}")
+        if not isinstance(record, dict):
+            raise HTTPException(status_code=422, detail=f"Line {line_number}: expected an object")
+        yield line_number, record
+
+
+def _validate_batch(adapter, batch, line_numbers):
+    # The whole batch goes through pydantic-core in one call
+    try:
+        return [item.model_dump() for item in adapter.validate_python(batch)]
+    except ValidationError as e:
+        errors = e.errors(include_url=False, include_context=False)[:MAX_REPORTED_ERRORS]
+        raise HTTPException(status_code=422, detail=[
+            {"line": line_numbers[error["loc"][0]], "loc": error["loc"][1:], "msg": error["msg"]} for error in errors
+        ])
+
+
+def _copy_in(db, model, rows):
+    # One COPY FROM STDIN per batch, inside the session's transaction
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows([r"\N" if row[key] is None else row[key] for key in columns] for row in rows)
+    buffer.seek(0)
+    table = model.__table__.name
+    with db.connection().connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+
+
+def import_rows(db, model, create_schema, stream, fmt):
+    # Validates and writes a text stream in batches of IMPORT_BATCH_SIZE within
+    # one transaction: either every row is imported or none is. Returns the row count.
+    records = _records(stream, fmt)
+    first = next(records, None)
+    if first is None:
+        return 0
+    with_id = "id" in first[1]
+    adapter = TypeAdapter(List[_with_id(create_schema) if with_id else create_schema])
+    allowed = set(create_schema.model_fields) | {"id"}
+    unknown = set(first[1]) - allowed
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown column(s): {', '.join(sorted(unknown))}")
+    conn = db.connection()
+    if with_id and model.__table__.name in partitioned_tables(conn) and not has_id_map(conn):
+        # The primary key of a partitioned table includes the partition key; ids
+        # are only unique through the id map (python manage.py partition-sessions)
+        raise HTTPException(status_code=422, detail="The table is partitioned: import it without an id column")
+    bind = db.get_bind()
+    write = (lambda rows: _copy_in(db, model, rows)) if _copy_supported(bind) else (lambda rows: db.execute(insert(model), rows))
+
+    count, batch, line_numbers = 0, [], []
+
+    def flush():
+        rows = _validate_batch(adapter, batch, line_numbers)
+        errors = []
+        check_rows(db, model, list(enumerate(rows)), errors)
+        if errors:
+            raise HTTPException(status_code=errors[0].get("status", 422), detail=[
+                {"line": line_numbers[error["index"]], "msg": error["detail"]} for error in errors[:MAX_REPORTED_ERRORS]
+            ])
+        try:
+            write(rows)
+        except (DBAPIError, bind.dialect.dbapi.Error) as e:
+            raise HTTPException(status_code=422, detail=f"Batch ending at line {line_numbers[-1]}: {getattr(e, 'orig', e)}")
+        batch.clear()
+        line_numbers.clear()
+        return len(rows)
+
+    for line_number, record in itertools.chain([first], records):
+        batch.append(record)
+        line_numbers.append(line_number)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            count += flush()
+    if batch:
+        count += flush()
+    db.commit()
+    if with_id:
+        # Explicit ids bypassed the sequence: move it past the new max(id)
+        sync_id_sequences(bind)
+    cache.invalidate(model.__table__.name)
+    # Too many rows to list: subscribers refetch the table
+    broker.publish(model.__table__.name, "imported")
+    return count
+
+
+# --- Routes ---
+async def _next_chunk(chunks):
+    return await anext(chunks, b"")
+
+
+class _RequestBody(io.RawIOBase):
+    # Blocking reader over the ASGI request body, for use from a worker thread
+    def __init__(self, request):
+        self._chunks = request.stream()
+        self._pending = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._pending:
+            self._pending = anyio.from_thread.run(_next_chunk, self._chunks)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size], self._pending = self._pending[:size], self._pending[size:]
+        return size
+
+
+def add_transfer_routes(router, prefix, model, schema, create_schema, get_db):
+    # /<prefix>/export and /<prefix>/import, streaming CSV or NDJSON; must be
+    # registered before the {id} routes
+    Format = Literal["csv", "ndjson"]
+
+    @router.get(f"{prefix}export")
+    def export(fmt: Format = Query("ndjson", alias="format")):
+        return StreamingResponse(export_rows(model, schema, fmt), media_type=FORMATS[fmt])
+
+    @router.post(f"{prefix}import", response_model=dict)
+    async def import_(request: Request, fmt: Format = Query("ndjson", alias="format"), db: Session = Depends(get_db)):
+        # The body is parsed as it arrives; the blocking work runs in the threadpool
+        stream = io.TextIOWrapper(io.BufferedReader(_RequestBody(request)), encoding="utf-8", newline="")
+        count = await run_in_threadpool(import_rows, db, model, create_schema, stream, fmt)
+        return {"imported": count}
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+import zlib
+from datetime import datetime, timedelta
+from typing import List, Optional
+from fastapi import APIRouter, Depends, Query
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from events import EVENTS_BACKEND, broker
+from filters import ListQuery, decode_cursor
+from models import JobState, SessionLocal, Warrantiescards
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, json_response, paginate
+from schemas import Page, WarrantyCard, naive_utc, utcnow
+
+logger = logging.getLogger(__name__)
+
+# Cards ending within this many days are reported as expiring
+WARRANTY_EXPIRY_DAYS = int(os.getenv('WARRANTY_EXPIRY_DAYS', '30'))
+# Seconds between expiry sweeps; 0 disables the background job
+WARRANTY_SWEEP_INTERVAL = int(os.getenv('WARRANTY_SWEEP_INTERVAL', '3600'))
+
+# Ids per published "expiring" event
+SWEEP_BATCH_SIZE = 500
+
+# With the postgres events backend one worker at a time sweeps for all
+SWEEP_LOCK = zlib.crc32(b"warrantiescards.expiry_sweep") & 0x7FFFFFFF
+SWEEP_JOB = "warrantiescards.expiry_sweep"
+
+# End of this process's previous sweep, with the memory events backend
+_local_sweep = {}
+
+
+def expiring_ids(db, start, end):
+    # Ids of cards ending in [start, end), in batches: one range scan of
+    # ix_warrantiescards_end_date streamed from a server-side cursor
+    stmt = (
+        select(Warrantiescards.id)
+        .where(Warrantiescards.end_date >= start, Warrantiescards.end_date < end)
+        .order_by(Warrantiescards.end_date, Warrantiescards.id)
+        .execution_options(yield_per=SWEEP_BATCH_SIZE)
+    )
+    for batch in db.scalars(stmt).partitions():
+        yield list(batch)
+
+
+def sweep_expiring(now=None, days=WARRANTY_EXPIRY_DAYS, interval=WARRANTY_SWEEP_INTERVAL):
+    # Publishes the cards that entered the "expiring within <days>" window since
+    # the previous sweep, i.e. ending in [previous now + days, now + days); the
+    # first sweep looks back one interval. Returns the number of cards reported.
+    # - postgres events backend: the events reach every worker, so one worker
+    #   sweeps (advisory lock) and the previous end is stored in job_state, so
+    #   a restart resumes where the last sweep stopped.
+    # - memory backend: each worker sweeps for its own subscribers and keeps
+    #   the previous end in memory; they can't have been connected before it.
+    now = now or utcnow()
+    end = now + timedelta(days=days)
+    shared = EVENTS_BACKEND == 'postgres'
+    with SessionLocal() as db:
+        if shared:
+            if not db.scalar(select(func.pg_try_advisory_xact_lock(SWEEP_LOCK))):
+                return 0
+            state = db.get(JobState, SWEEP_JOB)
+            start = state.done_until if state is not None else None
+        else:
+            start = _local_sweep.get(days)
+        if start is None:
+            start = end - timedelta(seconds=interval)
+        batches = list(expiring_ids(db, start, end)) if start < end else []
+        if shared:
+            db.merge(JobState(name=SWEEP_JOB, done_until=max(start, end)))
+            db.commit()
+        else:
+            _local_sweep[days] = max(start, end)
+    for ids in batches:
+        broker.publish("warrantiescards", "expiring", ids)
+    return sum(len(ids) for ids in batches)
+
+
+async def run_expiry_sweeps():
+    # Background job started by the app lifespan
+    while True:
+        await asyncio.sleep(WARRANTY_SWEEP_INTERVAL)
+        try:
+            await run_in_threadpool(sweep_expiring)
+        except Exception:
+            logger.exception("Warranty expiry sweep failed")
+
+
+def warranty_router(get_db):
+    # Fixed paths under /warrantiescards/, registered before the {id} routes
+    router = APIRouter()
+
+    @router.get("/warrantiescards/lookup", response_model=List[WarrantyCard])
+    def lookup_warranty(
+        vehicle_id: int,
+        provided_service_id: Optional[int] = None,
+        on: Optional[datetime] = Query(None, description="Date to check; now by default"),
+        db: Session = Depends(get_db),
+    ):
+        # Cards covering the vehicle (and service) at the date; empty means no warranty.
+        # An index range scan on (vehicle_id, provided_service_id, end_date).
+        on = naive_utc(on) if on is not None else utcnow()
+        stmt = select(Warrantiescards).where(
+            Warrantiescards.vehicle_id == vehicle_id,
+            Warrantiescards.end_date >= on,
+            Warrantiescards.start_date <= on,
+        )
+        if provided_service_id is not None:
+            stmt = stmt.where(Warrantiescards.provided_service_id == provided_service_id)
+        return db.scalars(stmt.order_by(Warrantiescards.end_date.desc())).all()
+
+    @router.get("/warrantiescards/expiring", response_model=Page[WarrantyCard])
+    def get_expiring(
+        days: int = Query(WARRANTY_EXPIRY_DAYS, ge=0, le=3660),
+        cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        db: Session = Depends(get_db),
+    ):
+        # Cards ending within <days>, soonest first, paged on (end_date, id)
+        now = utcnow()
+        query = ListQuery(
+            Warrantiescards,
+            filters=[Warrantiescards.end_date >= now, Warrantiescards.end_date < now + timedelta(days=days)],
+            sort_column=Warrantiescards.__table__.c.end_date,
+        )
+        if cursor is not None:
+            query.cursor = decode_cursor(query.sort_column, cursor)
+        return json_response(paginate(db, Warrantiescards, WarrantyCard, None, limit, query))
+
+    return router
@@ -0,0 +1,135 @@
+from collections import Counter
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import case, insert, select, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session, joinedload, selectinload
+from cache import cache
+from crud import check_write
+from events import broker
+from models import Repairparts, Repairsessions, RepairsessionsProvidedservices, RepairsessionsRepairparts
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from schemas import Page, RepairSession, RepairSessionExpanded, WorkOrderCreate
+
+# Expandable relation -> (loader option, attribute it is read from).
+# Many-to-one relations are joined into the main query, collections are
+# fetched with one SELECT ... IN per relation, so a page costs at most
+# 1 + number of expanded collections queries whatever its size.
+EXPANSIONS = {
+    "vehicle": (joinedload(Repairsessions.vehicle), "vehicle"),
+    "responsible": (joinedload(Repairsessions.responsible), "responsible"),
+    "master": (joinedload(Repairsessions.master), "master"),
+    "repair_parts": (
+        selectinload(Repairsessions.part_links).joinedload(RepairsessionsRepairparts.repair_part),
+        "part_links",
+    ),
+    "provided_services": (selectinload(Repairsessions.provided_services), "provided_services"),
+}
+
+
+def parse_expand(expand: Optional[str] = Query(None, description="Comma-separated: " + ",".join(EXPANSIONS))):
+    fields = [field.strip() for field in (expand or "").split(",") if field.strip()]
+    unknown = [field for field in fields if field not in EXPANSIONS]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown expand field(s): {', '.join(unknown)}")
+    return fields
+
+
+def _expanded_statement(fields):
+    return select(Repairsessions).options(*(EXPANSIONS[field][0] for field in fields))
+
+
+def _expand(session, fields):
+    data = RepairSession.model_validate(session).model_dump()
+    for field in fields:
+        data[field] = getattr(session, EXPANSIONS[field][1])
+    return RepairSessionExpanded.model_validate(data, from_attributes=True)
+
+
+def reserve_parts(db, needed):
+    # Take parts off the station stock in one set-based statement. Rows whose
+    # stock is too low don't match the WHERE, so nothing can go negative, and
+    # concurrent orders for the same part serialize on its row lock, where
+    # Postgres re-checks the condition against the committed amount.
+    if not needed:
+        return
+    amount = case(needed, value=Repairparts.id)
+    reserved = set(db.scalars(
+        update(Repairparts)
+        .where(Repairparts.id.in_(needed), Repairparts.amount_on_station >= amount)
+        .values(amount_on_station=Repairparts.amount_on_station - amount)
+        .returning(Repairparts.id)
+        .execution_options(synchronize_session=False)
+    ))
+    missing = sorted(set(needed) - reserved)
+    if missing:
+        db.rollback()
+        available = dict(db.execute(
+            select(Repairparts.id, Repairparts.amount_on_station).where(Repairparts.id.in_(missing))
+        ).all())
+        raise HTTPException(status_code=409, detail=[
+            {"repair_part_id": part_id, "requested": needed[part_id], "available": available.get(part_id)}
+            for part_id in missing
+        ])
+
+
+def workorder_router(get_db):
+    router = APIRouter()
+
+    @router.get("/repairsessions/expanded", response_model=Page[RepairSessionExpanded], response_model_exclude_unset=True)
+    def get_repairsessions_expanded(
+        after_id: Optional[int] = None,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        fields: list = Depends(parse_expand),
+        db: Session = Depends(get_db),
+    ):
+        stmt = _expanded_statement(fields).order_by(Repairsessions.id).limit(limit + 1)
+        if after_id is not None:
+            stmt = stmt.where(Repairsessions.id > after_id)
+        sessions = db.scalars(stmt).unique().all()
+        next_cursor = sessions[limit - 1].id if len(sessions) > limit else None
+        return Page[RepairSessionExpanded](items=[_expand(s, fields) for s in sessions[:limit]], next_cursor=next_cursor)
+
+    @router.get("/repairsessions/{id}/expanded", response_model=RepairSessionExpanded, response_model_exclude_unset=True)
+    def get_repairsession_expanded(id: int, fields: list = Depends(parse_expand), db: Session = Depends(get_db)):
+        session = db.scalars(_expanded_statement(fields).where(Repairsessions.id == id)).unique().first()
+        if not session:
+            raise HTTPException(status_code=404, detail="Repair session not found")
+        return _expand(session, fields)
+
+    @router.post("/repairsessions/workorder", response_model=RepairSession)
+    def create_workorder(order: WorkOrderCreate, db: Session = Depends(get_db)):
+        # Session, link rows and stock changes in a single transaction
+        needed = Counter()
+        for part in order.repair_parts:
+            needed[part.repair_part_id] += part.amount
+        service_ids = sorted(set(order.provided_service_ids))
+        fields = order.model_dump(exclude={"repair_parts", "provided_service_ids"})
+
+        check_write(db, Repairsessions, None, fields)
+        reserve_parts(db, needed)
+        try:
+            session = db.scalars(insert(Repairsessions).values(**fields).returning(Repairsessions)).one()
+            if needed:
+                db.execute(insert(RepairsessionsRepairparts), [
+                    {"repair_session_id": session.id, "repair_part_id": part_id, "amount": amount}
+                    for part_id, amount in needed.items()
+                ])
+            if service_ids:
+                db.execute(insert(RepairsessionsProvidedservices), [
+                    {"repair_session_id": session.id, "provided_service_id": service_id}
+                    for service_id in service_ids
+                ])
+        except DBAPIError as e:
+            db.rollback()
+            raise HTTPException(status_code=422, detail=str(e.orig))
+        result = RepairSession.model_validate(session)
+        db.commit()
+        cache.invalidate("repairsessions")
+        broker.publish("repairsessions", "created", [result.id], result.model_dump(mode="json"))
+        if needed:
+            cache.invalidate("repairparts")
+            broker.publish("repairparts", "updated", sorted(needed))
+        return result
+
+    return router